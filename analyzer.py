@@ -23,17 +23,23 @@
   (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
   SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 '''
-import matplotlib.patches as mpatches
-from matplotlib.lines import Line2D
 from statistics import mean,median, stdev
 from rich.console import Console
-import matplotlib.pyplot as plt
 from rich.table import Table
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
 from zipfile import ZipFile
+import multiprocessing
 import argparse
-import tempfile
-import shutil
-import glob
+import contextlib
+import cProfile
+import hashlib
+import atexit
+import json
+import time
+import csv
+import math
+import io
 import os
 
 def check_all_eq(list):
@@ -64,176 +70,723 @@ def is_num(ins):
 console = Console()
 
 parser = argparse.ArgumentParser()
-parser.add_argument("directory", help="select directory with zipped output afl++ dirs")
+parser.add_argument("directory", nargs='+', help="select directories with zipped output afl++ dirs")
+parser.add_argument("--report", metavar="DIR", help="headless batch mode, write figures and comparison tables of every directory to DIR")
+parser.add_argument("--figures", help="comma separated figure formats written by --report (png, svg), empty for none", default="png")
+parser.add_argument("--tables", help="comma separated table formats written by --report (csv, md, json)", default="csv,md,json")
+parser.add_argument("--live", help="the directories hold running, unzipped afl++ output dirs, refresh every --interval seconds", action="store_true")
+parser.add_argument("--interval", help="seconds between two refreshes of --live", type=float, default=10)
+parser.add_argument("--live-step", help="seconds between two points of the time grid the runs are resampled on with --live", type=float, default=60)
+parser.add_argument("--cache", help="directory where parsed archives are cached between runs")
+parser.add_argument("--grid", help="number of points of the common time grid the runs are resampled on", type=int, default=2000)
+parser.add_argument("--max-points", help="points per plotted curve after LTTB downsampling", type=int, default=1000)
+parser.add_argument("--thresholds", help="comma separated edges_found values, report the time each run took to reach them", default="")
+parser.add_argument("--bootstrap", help="bootstrap resamples for the confidence interval of the median difference", type=int, default=2000)
+parser.add_argument("--confidence", help="confidence level of the bootstrap interval", type=float, default=0.95)
+parser.add_argument("--seed", help="seed of the bootstrap resampling", type=int, default=0)
+parser.add_argument("--profile", help="print the time spent in each phase and the amount of data handled", action="store_true")
+parser.add_argument("--profile-out", help="save the profile, JSON if the name ends in .json, cProfile stats otherwise (implies --profile)")
+parser.add_argument("-j", "--jobs", help="number of archives parsed in parallel", type=int, default=os.cpu_count())
 args = parser.parse_args()
 
-#print(args.directory)
-if not os.path.isdir(args.directory):
-    console.log(f"Error: {args.directory} not found")
-    quit()
-
-console.log(f"parsing directory {args.directory}")
-
+edge_thresholds = [int(n) for n in args.thresholds.split(',') if n]
+
+figure_formats = [f for f in args.figures.split(',') if f]
+table_formats = [f for f in args.tables.split(',') if f]
+if set(figure_formats) - {'png', 'svg'}:
+    parser.error(f"unknown figure format in --figures {args.figures}")
+if set(table_formats) - {'csv', 'md', 'json'}:
+    parser.error(f"unknown table format in --tables {args.tables}")
+
+class Profile(object):
+    # with --profile off every hook is a no-op
+    def __init__(self, enabled, out=None):
+        self.enabled = enabled
+        self.out = out
+        self.phases = {}
+        self.counts = {}
+        self.start = time.perf_counter()
+        self.cprofile = None
+        if out is not None and not out.endswith('.json'):
+            self.cprofile = cProfile.Profile()
+            self.cprofile.enable()
+
+    def phase(self, name):
+        if not self.enabled:
+            return contextlib.nullcontext()
+        return self.timed_phase(name)
+
+    @contextlib.contextmanager
+    def timed_phase(self, name):
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            p = self.phases.setdefault(name, [0.0, 0.0, 0])
+            p[0] += time.perf_counter() - wall
+            p[1] += time.process_time() - cpu
+            p[2] += 1
+
+    def count(self, name, n=1):
+        if self.enabled:
+            self.counts[name] = self.counts.get(name, 0) + n
+
+    def finish(self):
+        if self.cprofile is not None:
+            self.cprofile.disable()
+            self.cprofile.dump_stats(self.out)
+        total = time.perf_counter() - self.start
+        table = Table(title="Profile")
+        table.add_column("Phase", justify="left", style="green", no_wrap=True)
+        table.add_column("Wall (s)", justify="right", no_wrap=True)
+        table.add_column("CPU (s)", justify="right", no_wrap=True)
+        table.add_column("Calls", justify="right", no_wrap=True)
+        for name, (wall, cpu, calls) in self.phases.items():
+            table.add_row(name, f'{wall:.3f}', f'{cpu:.3f}', str(calls))
+        # the pool workers do not show up in the CPU time of this process
+        table.add_row("total", f'{total:.3f}', f'{time.process_time():.3f}', "")
+        console.print(table)
+        for name, n in self.counts.items():
+            console.print(f"{name} : {n}")
+        if self.out is not None and self.cprofile is None:
+            with open(self.out, 'w') as f:
+                json.dump({'total_wall': total, 'total_cpu': time.process_time(), 'counts': self.counts,
+                           'phases': dict((name, {'wall': p[0], 'cpu': p[1], 'calls': p[2]}) for name, p in self.phases.items())}, f)
+
+profile = Profile(args.profile or args.profile_out is not None, args.profile_out)
+if profile.enabled:
+    atexit.register(profile.finish)
 
-files = os.listdir(args.directory)
-console.log("files found: ",files)
-tmpdir = tempfile.mkdtemp()
+#print(args.directory)
+for directory in args.directory:
+    if not os.path.isdir(directory):
+        console.log(f"Error: {directory} not found")
+        quit()
+
+def parse_stats(lines):
+    stats = {}
+    for l in lines:
+        name, value = l.replace('\n','').split(':')
+        name, value = name.strip(), str_to_num(value.strip().replace('%',''))
+        #console.print(name, value)
+        stats[name] = value
+    return stats
+
+def float_row(l):
+    try:
+        return [float(v) for v in l.split(',')]
+    except ValueError:
+        return None
 
-console.print(tmpdir)
+def parse_plot_rows(plot_keys, body):
+    # rows with a wrong number of fields (e.g. the last one of a killed fuzzer) are dropped
+    rows = [l for l in body.replace('%', '').split('\n') if l.count(',') == len(plot_keys) - 1]
+    try:
+        return np.loadtxt(rows, delimiter=',', ndmin=2) if rows else np.empty((0, len(plot_keys)))
+    except ValueError:
+        return np.array([r for r in map(float_row, rows) if r is not None], dtype=np.float64).reshape(-1, len(plot_keys))
+
+def parse_plot_data(text):
+    # relative_time, cycles_done, cur_item, corpus_count, pending_total, pending_favs, map_size, saved_crashes, saved_hangs, max_depth, execs_per_sec, total_execs, edges_found
+    header, _, body = text.partition('\n')
+    plot_keys = header[2:].strip().split(', ')
+    data = parse_plot_rows(plot_keys, body)
+    columns = {}
+    for index, k in enumerate(plot_keys):
+        col = data[:, index]
+        if np.all(col == np.floor(col)):
+            col = col.astype(np.int64)
+        columns[k] = col
+    return columns
+
+class PlotTail(object):
+    # plot_data of a running fuzzer, only the rows appended since the last refresh are parsed
+    def __init__(self, path):
+        self.path = path
+        self.offset = 0
+        self.keys = None
+        self.curves = RunCurves(args.live_step)
+
+    def refresh(self):
+        try:
+            with open(self.path, 'rb') as f:
+                if os.fstat(f.fileno()).st_size < self.offset:
+                    # the fuzzer was restarted and the file rewritten
+                    self.__init__(self.path)
+                f.seek(self.offset)
+                chunk = f.read()
+        except OSError:
+            return
+        # a line still being written is left for the next refresh
+        end = chunk.rfind(b'\n') + 1
+        if end == 0:
+            return
+        self.offset += end
+        profile.count('bytes read', end)
+        text = chunk[:end].decode(errors='replace')
+        if self.keys is None:
+            header, _, text = text.partition('\n')
+            self.keys = header[2:].strip().split(', ')
+        rows = parse_plot_rows(self.keys, text)
+        # the rows themselves are not kept, the run state is extended with them
+        self.curves.extend(dict((k, rows[:, index]) for index, k in enumerate(self.keys)))
+        profile.count('rows parsed', len(rows))
+
+live_tails = {}
+live_stats = {}
+live_groups = {}
+live_significance = {}
+
+def live_parsed(directory):
+    # same shape as the archives of a directory: [(stats, plots)]
+    stats = []
+    plots = []
+    for root, dirs, names in os.walk(directory):
+        # the queue and crash dirs of a run can be huge and never hold the files read here
+        dirs[:] = sorted(d for d in dirs if d not in ('queue', 'crashes', 'hangs', '.state', '.synced'))
+        rel = os.path.relpath(root, directory)
+        if 'fuzzer_stats' in names:
+            path = os.path.join(root, 'fuzzer_stats')
+            try:
+                with open(path) as f:
+                    live_stats[path] = parse_stats(f.readlines())
+            except (OSError, ValueError):
+                # rewritten while we read it, keep the previous values
+                pass
+            if path in live_stats:
+                stats.append((os.path.join(rel, 'fuzzer_stats'), live_stats[path]))
+        if 'plot_data' in names:
+            path = os.path.join(root, 'plot_data')
+            if path not in live_tails:
+                live_tails[path] = PlotTail(path)
+            live_tails[path].refresh()
+            if live_tails[path].keys is not None:
+                plots.append((os.path.join(rel, 'plot_data'), live_tails[path].curves))
+    return [(stats, plots)]
+
+def parse_archive(directory, fzip):
+    # runs in a worker, only the parsed data goes back to the parent
+    stats = []
+    plots = []
+    # only the central directory is read, nothing is extracted
+    with ZipFile(os.path.join(directory, fzip), 'r') as zObject:
+        for info in zObject.infolist():
+            if info.is_dir():
+                continue
+            name = info.filename.rsplit('/', 1)[-1]
+            if name not in ('fuzzer_stats', 'plot_data'):
+                continue
+            with zObject.open(info) as infd:
+                text = io.TextIOWrapper(infd).read()
+            if name == 'fuzzer_stats':
+                stats.append((os.path.join(fzip, info.filename), parse_stats(text.splitlines(True))))
+            else:
+                plots.append((os.path.join(fzip, info.filename), parse_plot_data(text)))
+    return stats, plots
+
+def archive_fingerprint(directory, fzip):
+    # path, size, mtime and the member CRCs of the central directory
+    archive = os.path.abspath(os.path.join(directory, fzip))
+    st = os.stat(archive)
+    h = hashlib.sha1(f"{archive}:{st.st_size}:{st.st_mtime_ns}".encode())
+    with ZipFile(archive, 'r') as zObject:
+        for info in zObject.infolist():
+            h.update(f"{info.filename}:{info.CRC}:{info.file_size}".encode())
+    return h.hexdigest()
+
+def cache_path(directory, fzip):
+    archive = os.path.abspath(os.path.join(directory, fzip))
+    return os.path.join(args.cache, hashlib.sha1(archive.encode()).hexdigest() + '.npz')
+
+def load_cached(directory, fzip, fingerprint):
+    try:
+        with np.load(cache_path(directory, fzip)) as data:
+            meta = json.loads(str(data['meta']))
+            if meta['fingerprint'] != fingerprint:
+                return None
+            plots = [(plot_path, dict((k, data[f'plot_{i}_{k}']) for k in keys)) for i, (plot_path, keys) in enumerate(meta['plots'])]
+            return [tuple(s) for s in meta['stats']], plots
+    except (OSError, KeyError, ValueError):
+        return None
+
+def store_cached(directory, fzip, fingerprint, parsed):
+    stats, plots = parsed
+    meta = {'fingerprint': fingerprint, 'stats': stats, 'plots': [(plot_path, list(columns)) for plot_path, columns in plots]}
+    arrays = {'meta': np.array(json.dumps(meta))}
+    for i, (_, columns) in enumerate(plots):
+        for k, col in columns.items():
+            arrays[f'plot_{i}_{k}'] = col
+    # write and rename, a concurrent or killed run never sees half a file
+    tmp = cache_path(directory, fzip) + f'.{os.getpid()}.tmp.npz'
+    np.savez(tmp, **arrays)
+    os.replace(tmp, cache_path(directory, fzip))
+
+def load_archive(directory, fzip):
+    if args.cache is None:
+        return parse_archive(directory, fzip)
+    fingerprint = archive_fingerprint(directory, fzip)
+    parsed = load_cached(directory, fzip, fingerprint)
+    if parsed is None:
+        parsed = parse_archive(directory, fzip)
+        store_cached(directory, fzip, fingerprint, parsed)
+    return parsed
 
-for index, fzip in enumerate(files):
-#console.log(tempfile.gettempdir())
-    with ZipFile(os.path.join(args.directory, fzip), 'r') as zObject:
-        if "baseline" in fzip.lower():
-            index = f"baseline_{index}"
-        zObject.extractall(os.path.join(tmpdir, f"output_{index}"))
+show_stats = ['cycles_done', 'cycles_wo_finds', 'execs_done', 'execs_per_sec', 'corpus_count', 
+              'corpus_favored', 'corpus_found','max_depth','pending_favs', #'pending_total', 
+              'stability', 'bitmap_cvg', 'saved_crashes', 'saved_hangs', 'edges_found','total_edges',
+              'testcache_size', 'testcache_count' ]
 
-stats_files_path = glob.glob(tmpdir + "/**/fuzzer_stats", recursive = True)
-console.print(stats_files_path)
+def fmt_diff(diff):
+    pre_diff = "R Eq B "
+    if diff != 0:
+        pre_diff = "R less " if diff < 0 else "R more "
+    return f'{pre_diff} {abs(diff):.3f}'
+
+# (title, row key, format), the same rows feed the console table and the report files
+table_columns = [("baseline", "baseline", lambda v: f'{v:.3f}'),
+                 ("runs median", "runs_median", lambda v: f'{v:.3f}'),
+                 ("diff", "diff", fmt_diff),
+                 ("diff%", "diff_pct", lambda v: f'{"+"if v>=0 else ""}{v:.3f}%'),
+                 ("p (MWU)", "p_value", lambda v: f'{v:.4f}'),
+                 ("A12", "a12", lambda v: f'{v:.3f}'),
+                 ("diff CI low", "ci_low", lambda v: f'{v:.3f}'),
+                 ("diff CI high", "ci_high", lambda v: f'{v:.3f}')]
+
+def compare_stats(stats_baseline, stats_cmp_run, keys=show_stats):
+    rows = []
+    for k in stats_baseline:
+        if k not in keys:
+            continue
+        try:
+            sb_median = median(stats_baseline[k])
+            sr_median = median(stats_cmp_run[k])
+            diff = sr_median - sb_median
+            # diff/base=x/100
+            perc = 0.0
+            if(sb_median!=0):
+                perc = (diff/sb_median)*100
+            rows.append({'metric': k, 'baseline': sb_median, 'runs_median': sr_median, 'diff': diff, 'diff_pct': perc})
+        except:
+            print(k, 'err')
+            continue
+        #print(k, median(stats_baseline[k]), median(stats_cmp_run[k]))
+    return rows
+
+_u_counts = {}
+
+def u_counts(m, n):
+    # number of orderings of m vs n values giving each U, the exact null distribution without ties
+    if m == 0 or n == 0:
+        return np.ones(1, dtype=np.float64)
+    if (m, n) not in _u_counts:
+        counts = np.zeros(m * n + 1)
+        counts[n:] += u_counts(m - 1, n)
+        counts[:m * (n - 1) + 1] += u_counts(m, n - 1)
+        _u_counts[(m, n)] = counts
+    return _u_counts[(m, n)]
+
+def mann_whitney_p(u, x, y):
+    # two sided, exact for small samples without ties, normal approximation otherwise
+    m, n = len(x), len(y)
+    pooled = np.concatenate([x, y])
+    _, ties = np.unique(pooled, return_counts=True)
+    if max(m, n) <= 8 and np.all(ties == 1):
+        dist = u_counts(m, n)
+        dist = dist / dist.sum()
+        k = int(round(u))
+        return min(1.0, 2 * min(dist[:k + 1].sum(), dist[k:].sum()))
+    N = m + n
+    sigma = math.sqrt(m * n / 12 * ((N + 1) - (ties ** 3 - ties).sum() / (N * (N - 1))))
+    if sigma == 0:
+        return 1.0
+    z = max(abs(u - m * n / 2) - 0.5, 0) / sigma
+    return math.erfc(z / math.sqrt(2))
+
+significance_keys = ['p_value', 'a12', 'ci_low', 'ci_high']
+
+def significance(stats_baseline, stats_cmp_run, rows, memo=None):
+    # metrics with the same number of runs are stacked and handled with one set of array operations
+    # memo maps a metric to its last values and results, a metric whose values did not change is not resampled
+    alpha = 1 - args.confidence
+    groups = {}
+    for row in rows:
+        b = np.asarray(stats_baseline[row['metric']], dtype=np.float64)
+        r = np.asarray(stats_cmp_run[row['metric']], dtype=np.float64)
+        key = (b.tobytes(), r.tobytes())
+        if memo is not None and row['metric'] in memo and memo[row['metric']][0] == key:
+            row.update(memo[row['metric']][1])
+            continue
+        groups.setdefault((len(b), len(r)), []).append((row, b, r))
+    for (nb, nr), members in groups.items():
+        # seeded per group, the result of a metric only depends on its own values
+        rng = np.random.default_rng(args.seed)
+        B = np.vstack([b for _, b, _ in members])
+        R = np.vstack([r for _, _, r in members])
+        # Vargha-Delaney A12, P(run > baseline) + P(run == baseline) / 2, U of the runs follows from it
+        gt = (R[:, :, None] > B[:, None, :]).sum(axis=(1, 2))
+        eq = (R[:, :, None] == B[:, None, :]).sum(axis=(1, 2))
+        a12 = (gt + 0.5 * eq) / (nb * nr)
+        # the same resampling indexes are used for every metric of the group
+        boot_b = np.median(B[:, rng.integers(0, nb, (args.bootstrap, nb))], axis=2)
+        boot_r = np.median(R[:, rng.integers(0, nr, (args.bootstrap, nr))], axis=2)
+        ci_low, ci_high = np.percentile(boot_r - boot_b, [100 * alpha / 2, 100 * (1 - alpha / 2)], axis=1)
+        for i, (row, b, r) in enumerate(members):
+            row['p_value'] = mann_whitney_p(a12[i] * nb * nr, r, b)
+            row['a12'] = float(a12[i])
+            row['ci_low'] = float(ci_low[i])
+            row['ci_high'] = float(ci_high[i])
+            if memo is not None:
+                memo[row['metric']] = ((b.tobytes(), r.tobytes()), dict((k, row[k]) for k in significance_keys))
+
+def print_table(directory, rows):
+    table = Table(title=f"Comparison output {directory}")
+
+    table.add_column("Data", justify="left", style="green", no_wrap=True)
+    for title, _, _ in table_columns:
+        table.add_column(title, justify="left", no_wrap=True)
+    table.add_column("Data", justify="right", style="green", no_wrap=True)
+
+    for row in rows:
+        table.add_row(row['metric'], *[fmt(row[key]) for _, key, fmt in table_columns], row['metric'])
+    console.print(table)
+
+def write_tables(base, directory, rows):
+    if 'csv' in table_formats:
+        with open(base + '.csv', 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['metric'] + [key for _, key, _ in table_columns])
+            for row in rows:
+                writer.writerow([row['metric']] + [row[key] for _, key, _ in table_columns])
+    if 'md' in table_formats:
+        with open(base + '.md', 'w') as f:
+            f.write(f"# Comparison output {directory}\n\n")
+            f.write("| Data | " + " | ".join(title for title, _, _ in table_columns) + " |\n")
+            f.write("|---" * (len(table_columns) + 1) + "|\n")
+            for row in rows:
+                f.write(f"| {row['metric']} | " + " | ".join(fmt(row[key]) for _, key, fmt in table_columns) + " |\n")
+    if 'json' in table_formats:
+        with open(base + '.json', 'w') as f:
+            json.dump({'directory': directory, 'rows': rows}, f, indent=2, default=float)
+
+def lttb(x, y, n_out):
+    # largest triangle three buckets, returns the indexes of the points to keep
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    idx = [0]
+    for i in range(n_out - 2):
+        lo, hi = edges[i], edges[i + 1]
+        if i + 2 < len(edges):
+            ax, ay = x[hi:edges[i + 2]].mean(), y[hi:edges[i + 2]].mean()
+        else:
+            ax, ay = x[-1], y[-1]
+        px, py = x[idx[-1]], y[idx[-1]]
+        area = np.abs((px - ax) * (y[lo:hi] - py) - (px - x[lo:hi]) * (ay - py))
+        idx.append(lo + int(np.argmax(area)))
+    idx.append(n - 1)
+    return np.array(idx)
+
+plot_metrics = ['pending_total', 'corpus_count', 'saved_crashes']
+curve_metrics = ['edges_found', 'corpus_count', 'saved_crashes']
+
+class Growable(object):
+    # float array that doubles when full, appending stays proportional to the new values
+    def __init__(self):
+        self.data = np.empty(1024)
+        self.size = 0
+
+    def append(self, values):
+        if self.size + len(values) > len(self.data):
+            grown = np.empty(max(2 * len(self.data), self.size + len(values)))
+            grown[:self.size] = self.data[:self.size]
+            self.data = grown
+        self.data[self.size:self.size + len(values)] = values
+        self.size += len(values)
+
+    def truncate(self, size):
+        self.size = min(self.size, size)
+
+    def view(self):
+        return self.data[:self.size]
+
+class RunCurves(object):
+    # state of one run that is only extended with new rows: the values on a grid of
+    # fixed step, the area under each curve and the first time a threshold was reached
+    def __init__(self, step):
+        self.step = step
+        self.rows = 0
+        self.n_grid = 0
+        self.t_last = None
+        self.last = {}
+        self.grid = {}
+        self.area = {}
+        self.first = {}
+
+    def extend(self, columns):
+        t = np.asarray(columns['relative_time'], dtype=np.float64)
+        if not len(t):
+            return
+        n_grid = max(self.n_grid, int(t[-1] // self.step) + 1)
+        x = np.arange(self.n_grid, n_grid) * self.step
+        for m in set(plot_metrics + curve_metrics):
+            if m not in columns:
+                continue
+            y = np.asarray(columns[m], dtype=np.float64)
+            # the previous last row joins the new rows to the old ones
+            if self.t_last is not None:
+                tt, yy = np.concatenate([[self.t_last], t]), np.concatenate([[self.last[m]], y])
+            else:
+                tt, yy = t, y
+            self.grid.setdefault(m, Growable()).append(np.interp(x, tt, yy))
+            # a sample holds until the next one
+            self.area[m] = self.area.get(m, 0.0) + float(np.dot(yy[:-1], np.diff(tt)))
+            self.last[m] = float(y[-1])
+            thresholds = edge_thresholds if m == 'edges_found' else [1] if m == 'saved_crashes' else []
+            for n in thresholds:
+                if (m, n) not in self.first:
+                    hit = np.flatnonzero(y >= n)
+                    if len(hit):
+                        self.first[(m, n)] = float(t[hit[0]])
+        self.rows += len(t)
+        self.n_grid = n_grid
+        self.t_last = float(t[-1])
+
+    def auc(self, m, t_end):
+        # the last sample holds until the end of the longest run
+        return self.area[m] + self.last[m] * (t_end - self.t_last)
+
+    def time_to(self, m, n, t_end):
+        # a run that never gets there is counted as reaching it at the end
+        return self.first.get((m, n), t_end)
+
+    def values(self, m, start, stop):
+        # a run that ended keeps its last value
+        v = np.full(stop - start, self.last[m])
+        own = self.grid[m].view()[start:stop]
+        v[:len(own)] = own
+        return v
+
+class GroupCurves(object):
+    # median and quartiles of the runs of a group, the grid points every run
+    # went past do not change any more and are not computed again
+    def __init__(self):
+        self.runs = []
+        self.final = 0
+        self.q = {}
+
+    def update(self, runs, metrics):
+        if [id(r) for r in runs] != [id(r) for r in self.runs]:
+            self.__init__()
+            self.runs = list(runs)
+        n = max(r.n_grid for r in runs)
+        x = np.arange(n) * runs[0].step
+        agg = {}
+        for m in metrics:
+            if not all(m in r.grid for r in runs):
+                continue
+            curves = np.vstack([r.values(m, self.final, n) for r in runs])
+            q = self.q.setdefault(m, [Growable(), Growable(), Growable()])
+            for g, values in zip(q, np.percentile(curves, [25, 50, 75], axis=0)):
+                g.truncate(self.final)
+                g.append(values)
+            q25, q50, q75 = (g.view() for g in q)
+            keep = lttb(x, q50, args.max_points)
+            agg[m] = (x[keep], q25[keep], q50[keep], q75[keep])
+        self.final = min(r.n_grid for r in runs)
+        return agg
+
+def curve_summary(runs, t_end):
+    summary = {}
+    for m in curve_metrics:
+        if all(m in r.area for r in runs):
+            summary[f'auc_{m}'] = [r.auc(m, t_end) for r in runs]
+    if all('edges_found' in r.area for r in runs):
+        for n in edge_thresholds:
+            summary[f'time_to_edges_{n}'] = [r.time_to('edges_found', n, t_end) for r in runs]
+    if all('saved_crashes' in r.area for r in runs):
+        summary['time_to_first_crash'] = [r.time_to('saved_crashes', 1, t_end) for r in runs]
+    return summary
+
+def plot_runs(directory, plot_baseline, plot_cmp_run, outputs=None, live=False):
+    # matplotlib is only imported when a figure is actually drawn
+    import matplotlib
+    if outputs:
+        matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    # --live redraws the same window on every refresh
+    fig = plt.figure(directory if live else None)
+    fig.clf()
+    # median lines with interquartile bands, a colour per metric and group and a line style per metric
+    styles = {'pending_total': '-', 'corpus_count': '--', 'saved_crashes': ':'}
+    for agg, group, colors in ((plot_baseline, 'baseline', {'pending_total': 'blue', 'corpus_count': 'green', 'saved_crashes': 'black'}),
+                               (plot_cmp_run, 'runs', {'pending_total': 'orange', 'corpus_count': 'purple', 'saved_crashes': 'red'})):
+        for m in agg:
+            t, q25, q50, q75 = agg[m]
+            plt.plot(t, q50, color=colors[m], linestyle=styles[m], label=f'{m} {group}')
+            plt.fill_between(t, q25, q75, alpha=0.25, color=colors[m])
+
+    plt.title(directory)
+    # the legend lists the curves that were actually drawn
+    if plot_baseline or plot_cmp_run:
+        plt.legend(title='median, band: 25th-75th percentile')
+    if outputs:
+        for path in outputs:
+            fig.savefig(path)
+        plt.close(fig)
+    elif live:
+        plt.pause(0.001)
+    else:
+        plt.show()
 
-plotdata_files_path = glob.glob(tmpdir + "/**/plot_data", recursive = True)
-console.print(plotdata_files_path)
+def analyze(directory, parsed, live=False):
+    stats_files = [s for stats, _ in parsed for s in stats]
+    plotdata_files = [p for _, plots in parsed for p in plots]
 
-stats_baseline = {}
-stats_cmp_run  = {}
+    console.print([stat_path for stat_path, _ in stats_files])
+    console.print([plot_path for plot_path, _ in plotdata_files])
 
+    stats_baseline = {}
+    stats_cmp_run  = {}
 
-for stat_path in stats_files_path:
-    dict_selected = stats_baseline if 'baseline' in stat_path.lower() else stats_cmp_run
-    with open(stat_path) as infd:
-        lines = infd.readlines()
-        for l in lines:
-            name, value = l.replace('\n','').split(':')
-            name, value = name.strip(), str_to_num(value.strip().replace('%',''))
-            #console.print(name, value)
+    for stat_path, stats in stats_files:
+        dict_selected = stats_baseline if 'baseline' in stat_path.lower() else stats_cmp_run
+        for name, value in stats.items():
             if name not in dict_selected:
                 dict_selected[name] = []
             dict_selected[name] += [value]
 
+    #console.print(stats_baseline)
+    #console.print(stats_cmp_run)
+
+    if not check_all_eq(stats_cmp_run.get('target_mode', [])+stats_baseline.get('target_mode', [])):
+        console.log("Error not all runs equal to baseline a")
+    if not check_all_eq(stats_cmp_run.get('afl_banner', [])+stats_baseline.get('afl_banner', [])):
+        console.log("Error not all runs equal to baseline b")
+    if not check_all_eq(stats_cmp_run.get('afl_version', [])+stats_baseline.get('afl_version', [])):
+        console.log("Error not all runs equal to baseline c")
+
+    csv_files_plot = {}
+
+    plot_baseline = {}
+    plot_cmp_run  = {}
+
+    for plot_path, dict_selected in plotdata_files:
+        csv_files_plot[plot_path]=dict_selected
+
+    console.print(len(csv_files_plot))
+
+    with profile.phase('aggregate'):
+        if live:
+            # the runs were extended with the new rows by live_parsed, the groups keep their final part
+            groups = live_groups.setdefault(directory, (GroupCurves(), GroupCurves()))
+        else:
+            # the archived runs are complete, the longest one gets --grid points
+            t_end = max([c['relative_time'][-1] for c in csv_files_plot.values() if len(c['relative_time'])], default=0)
+            step = t_end / (args.grid - 1) if t_end > 0 else 1.0
+            for plot_path, columns in csv_files_plot.items():
+                csv_files_plot[plot_path] = RunCurves(step)
+                csv_files_plot[plot_path].extend(columns)
+            groups = (GroupCurves(), GroupCurves())
+        runs_baseline = [c for d, c in csv_files_plot.items() if 'baseline' in d.lower() and c.rows]
+        runs_cmp = [c for d, c in csv_files_plot.items() if 'baseline' not in d.lower() and c.rows]
+        t_end = max([c.t_last for c in runs_baseline + runs_cmp], default=0)
+        if runs_baseline:
+            plot_baseline = groups[0].update(runs_baseline, plot_metrics)
+        if runs_cmp:
+            plot_cmp_run = groups[1].update(runs_cmp, plot_metrics)
+
+    with profile.phase('statistics'):
+        # the curve summaries go in the same table as the fuzzer_stats values
+        if runs_baseline:
+            stats_baseline.update(curve_summary(runs_baseline, t_end))
+        if runs_cmp:
+            stats_cmp_run.update(curve_summary(runs_cmp, t_end))
+        curve_keys = [k for k in stats_baseline if k.startswith(('auc_', 'time_to_'))]
+        rows = compare_stats(stats_baseline, stats_cmp_run) + compare_stats(stats_baseline, stats_cmp_run, curve_keys)
+        significance(stats_baseline, stats_cmp_run, rows, live_significance.setdefault(directory, {}) if live else None)
+
+    return rows, plot_baseline, plot_cmp_run
+
+report_names = {}
+
+def report_base(directory):
+    # one set of files per directory, named after it
+    if directory not in report_names:
+        name = os.path.basename(os.path.normpath(directory))
+        unique, n = name, 1
+        while unique in report_names.values():
+            unique, n = f"{name}_{n}", n + 1
+        report_names[directory] = unique
+    return os.path.join(args.report, report_names[directory])
+
+def output(directory, dir_parsed, live=False):
+    rows, plot_baseline, plot_cmp_run = analyze(directory, dir_parsed, live)
+    with profile.phase('table'):
+        print_table(directory, rows)
+
+    if args.report is None:
+        with profile.phase('render'):
+            plot_runs(directory, plot_baseline, plot_cmp_run, live=live)
+        return
+
+    base = report_base(directory)
+    with profile.phase('table'):
+        write_tables(base, directory, rows)
+    if figure_formats:
+        with profile.phase('render'):
+            plot_runs(directory, plot_baseline, plot_cmp_run, [f"{base}.{fmt}" for fmt in figure_formats])
+    console.log(f"report for {directory} written to {base}.*")
+
+if args.report is not None:
+    os.makedirs(args.report, exist_ok=True)
+
+if args.live:
+    try:
+        while True:
+            for directory in args.directory:
+                with profile.phase('refresh'):
+                    dir_parsed = live_parsed(directory)
+                output(directory, dir_parsed, live=True)
+            if args.report is None:
+                # keeps the windows responsive while waiting
+                import matplotlib.pyplot as plt
+                plt.pause(args.interval)
+            else:
+                time.sleep(args.interval)
+    except KeyboardInterrupt:
+        pass
+    quit()
 
-#console.print(stats_baseline)
-#console.print(stats_cmp_run)
-
-if not check_all_eq(stats_cmp_run['target_mode']+stats_baseline['target_mode']):
-    console.log("Error not all runs equal to baseline a")
-if not check_all_eq(stats_cmp_run['afl_banner']+stats_baseline['afl_banner']):
-    console.log("Error not all runs equal to baseline b")
-if not check_all_eq(stats_cmp_run['afl_version']+stats_baseline['afl_version']):
-    console.log("Error not all runs equal to baseline c")
-
-table = Table(title=f"Comparison output {args.directory}")
-
-table.add_column("Data", justify="left", style="green", no_wrap=True)
-table.add_column("baseline", justify="left", no_wrap=True)
-table.add_column("runs median", justify="left", no_wrap=True)
-table.add_column("diff", justify="left", no_wrap=True)
-table.add_column("diff%", justify="left", no_wrap=True)
-table.add_column("Data", justify="right", style="green", no_wrap=True)
-
-
-#console.print(stats_baseline)
-
-show_stats = ['cycles_done', 'cycles_wo_finds', 'execs_done', 'execs_per_sec', 'corpus_count', 
-              'corpus_favored', 'corpus_found','max_depth','pending_favs', #'pending_total', 
-              'stability', 'bitmap_cvg', 'saved_crashes', 'saved_hangs', 'edges_found','total_edges',
-              'testcache_size', 'testcache_count' ]
+if args.cache is not None:
+    os.makedirs(args.cache, exist_ok=True)
+
+# the archives of all the directories go through a single pool
+archives = []
+with profile.phase('list'):
+    for directory in args.directory:
+        console.log(f"parsing directory {directory}")
+        files = os.listdir(directory)
+        console.log("files found: ",files)
+        archives += [(directory, fzip) for fzip in files]
+
+with profile.phase('unzip and parse'):
+    if args.jobs > 1 and len(archives) > 1:
+        # fork, the workers must not re-run this script
+        with ProcessPoolExecutor(min(args.jobs, len(archives)), mp_context=multiprocessing.get_context('fork')) as pool:
+            parsed = list(pool.map(load_archive, [d for d, _ in archives], [fzip for _, fzip in archives]))
+    else:
+        parsed = [load_archive(directory, fzip) for directory, fzip in archives]
 
-for k in stats_baseline:
-    if k not in show_stats:
-        continue
-    try:
-        sb_median = median(stats_baseline[k])
-        sr_median = median(stats_cmp_run[k])
-        diff = sr_median - sb_median
-        # diff/base=x/100
-        perc = 0.0
-        if(sb_median!=0):
-            perc = (diff/sb_median)*100
-
-        pre_diff = "R Eq B "
-        if diff != 0:
-            pre_diff = "R less " if diff < 0 else "R more "
-        table.add_row(k, f'{sb_median:.3f}', f'{sr_median:.3f}', f'{pre_diff} {abs(diff):.3f}', f'{"+"if perc>=0 else ""}{perc:.3f}%',k )
-
-        print()
-    except:
-        print(k, 'err')
-        continue
-    #print(k, median(stats_baseline[k]), median(stats_cmp_run[k]))
-
-console.print(table)
-
-csv_files_plot = {}
-
-plot_baseline = {}
-plot_cmp_run  = {}
-
-for plot_path in plotdata_files_path:
-    dict_selected = {}
-    with open(plot_path) as infd:
-        lines = infd.readlines()
-        plot_keys = lines[0][2:].strip().split(', ')
-        #console.print(plot_keys)
-        for k in plot_keys:
-            if k not in dict_selected:
-                dict_selected[k]=[]
-
-        for l in lines[1:]:
-            for index, value in enumerate(l.strip().split(', ')):
-            # # relative_time, cycles_done, cur_item, corpus_count, pending_total, pending_favs, map_size, saved_crashes, saved_hangs, max_depth, execs_per_sec, total_execs, edges_found
-                try:
-                    dict_selected[plot_keys[index]]+=[str_to_num(value)]
-                except:
-                    continue
-    csv_files_plot[plot_path]=dict_selected
-    
-
-console.print(len(csv_files_plot))
-
-for d in csv_files_plot:
-    if 'baseline' in d.lower():
-        plt.plot(csv_files_plot[d]['relative_time'],csv_files_plot[d]['pending_total'],label = "pending_total B", color="blue")
-        # plt.plot(csv_files_plot[d]['relative_time'],csv_files_plot[d]['pending_favs'],label = "pending_favs B")
-        # plt.plot(csv_files_plot[d]['relative_time'],csv_files_plot[d]['cycles_done'],label = "cycles_done B")
-        # plt.plot(csv_files_plot[d]['relative_time'],csv_files_plot[d]['saved_crashes'],label = "saved_crashes B")
-        # plt.plot(csv_files_plot[d]['relative_time'],csv_files_plot[d]['saved_hangs'],label = "saved_hangs B")
-        # plt.plot(csv_files_plot[d]['relative_time'],csv_files_plot[d]['max_depth'],label = "max_depth B")
-        plt.fill_between(csv_files_plot[d]['relative_time'],csv_files_plot[d]['corpus_count'], alpha=0.4,color="blue")
-        # plt.fill_between(csv_files_plot[d]['relative_time'],csv_files_plot[d]['cur_item'], alpha=0.1,color="cyan")
-        plt.fill_between(csv_files_plot[d]['relative_time'],csv_files_plot[d]['saved_crashes'], alpha=0.4,color="black")
-        # plt.show()
+if profile.enabled:
+    profile.count('archives', len(archives))
+    profile.count('bytes read', sum(os.path.getsize(os.path.join(d, fzip)) for d, fzip in archives))
+    profile.count('rows parsed', sum(len(columns['relative_time']) for _, plots in parsed for _, columns in plots if 'relative_time' in columns))
 
+parsed_dirs = dict((directory, []) for directory in args.directory)
+for (directory, _), p in zip(archives, parsed):
+    parsed_dirs[directory].append(p)
 
-    else:
-        plt.plot(csv_files_plot[d]['relative_time'],csv_files_plot[d]['pending_total'],label = f"pending_total", color="orange")
-        # plt.plot(csv_files_plot[d]['relative_time'],csv_files_plot[d]['pending_favs'],label = f"pending_favs")
-        # plt.plot(csv_files_plot[d]['relative_time'],csv_files_plot[d]['cycles_done'],label = f"cycles_done")
-        # plt.plot(csv_files_plot[d]['relative_time'],csv_files_plot[d]['saved_crashes'],label = f"saved_crashes")
-        # plt.plot(csv_files_plot[d]['relative_time'],csv_files_plot[d]['saved_hangs'],label = f"saved_hangs")
-        # plt.plot(csv_files_plot[d]['relative_time'],csv_files_plot[d]['max_depth'],label = f"max_depth")
-        plt.fill_between(csv_files_plot[d]['relative_time'],csv_files_plot[d]['corpus_count'], alpha=0.4, color="orange")
-        # plt.fill_between(csv_files_plot[d]['relative_time'],csv_files_plot[d]['cur_item'], alpha=0.1, color="yellow")
-        plt.fill_between(csv_files_plot[d]['relative_time'],csv_files_plot[d]['saved_crashes'], alpha=0.4,color="red")
-        # plt.show()
-        
-scb = Line2D([0], [0],color='red', label='saved_crashes runs')
-scr = Line2D([0], [0],color='black', label='saved_crashes baseline')
-ptr = Line2D([0], [0],color='blue', label='pending_total baseline')
-ptb = Line2D([0], [0],color='orange', label='pending_total runs')
-
-ccb = mpatches.Patch(color='blue', label='corpus_count baseline')
-ccr = mpatches.Patch(color='orange', label='corpus_count runs')
-
-plt.title(args.directory)
-plt.legend(handles=[scb, scr,ptr,ptb,ccb,ccr])
-# # show a legend on the plot
-# plt.legend()
-# # function to show the plot
-plt.show()
-
-# console.print(plot_baseline)
-# console.print(plot_cmp_run)
-
-print('deletng')
-shutil.rmtree(tmpdir, ignore_errors=True)
-print('deletng end')
+for directory, dir_parsed in parsed_dirs.items():
+    output(directory, dir_parsed)
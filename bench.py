@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+'''
+  Copyright (c) 2023, the triage.py and analyzer.py authors
+
+
+  Redistribution and use in source and binary forms, with or without
+  modification, are permitted provided that the following conditions are met:
+
+  1. Redistributions of source code must retain the above copyright notice, this
+     list of conditions and the following disclaimer.
+  2. Redistributions in binary form must reproduce the above copyright notice,
+     this list of conditions and the following disclaimer in the documentation
+     and/or other materials provided with the distribution.
+
+  THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+  ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+  WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+  DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+  ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+  (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+  LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+  ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+  (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+  SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+'''
+
+from zipfile import ZipFile, ZIP_DEFLATED
+import subprocess
+import argparse
+import tempfile
+import datetime
+import random
+import shutil
+import json
+import time
+import sys
+import os
+
+OKBLUE = '\033[94m'
+OKGREEN = '\033[92m'
+ENDC = '\033[0m'
+
+DESCR = """Benchmark triage.py and analyzer.py on synthetic crash corpora and AFL++ output dirs"""
+
+dir_path = os.path.dirname(os.path.realpath(__file__))
+
+opt = argparse.ArgumentParser(description=DESCR, formatter_class=argparse.RawTextHelpFormatter)
+opt.add_argument("--workdir", help="Generate the inputs here and keep them (default: a temporary directory)", action='store')
+opt.add_argument("--only", help="Run only one of the benchmarks", choices=["triage", "analyzer"], action='store')
+opt.add_argument("--seed", help="Seed of the generated inputs", action='store', type=int, default=1)
+opt.add_argument("--repeat", help="Runs of every benchmark, the median is reported", action='store', type=int, default=3)
+opt.add_argument("--history", help="Append the results to this json-lines file", action='store')
+opt.add_argument("--dirs", help="Crash directories", action='store', type=int, default=2)
+opt.add_argument("--testcases", help="Testcases in every crash directory", action='store', type=int, default=1000)
+opt.add_argument("--bugs", help="Distinct bugs the testcases are drawn from", action='store', type=int, default=50)
+opt.add_argument("--ubsan", help="Fraction of UBSan testcases, the rest crash under ASan", action='store', type=float, default=0.3)
+opt.add_argument("--hangs", help="Fraction of hanging testcases", action='store', type=float, default=0.005)
+opt.add_argument("--output-kb", help="KiB of target output before the sanitizer report", action='store', type=int, default=4)
+opt.add_argument("--timeout", help="--timeout given to triage.py", action='store', type=float, default=1)
+opt.add_argument("--jobs", help="-p of triage.py and -j of analyzer.py", action='store', type=int, default=os.cpu_count())
+opt.add_argument("--archives", help="Zipped AFL++ output dirs, half of them baseline", action='store', type=int, default=10)
+opt.add_argument("--plot-rows", help="Rows in the plot_data of every archive", action='store', type=int, default=100000)
+args = opt.parse_args()
+
+# the stand-in target: the first line of the testcase says which report to emit
+FAKE_TARGET = r'''#!/usr/bin/env python3
+import sys, time
+data = open(sys.argv[1], 'rb').read() if len(sys.argv) > 1 else sys.stdin.buffer.read()
+kind, bug, noise = data.split(b'\n', 1)[0].split()
+bug, noise = int(bug), int(noise)
+out = sys.stderr
+out.write(('INFO: running the testcase ' + 'x' * 60 + '\n') * (noise * 1024 // 90))
+if kind == b'hang':
+    out.flush()
+    time.sleep(3600)
+elif kind == b'ubsan':
+    out.write('/src/bug%d.c:%d:5: runtime error: signed integer overflow: 2147483647 + 1 cannot be represented in type int\n' % (bug, bug + 10))
+elif kind == b'asan':
+    out.write('=================================================================\n')
+    out.write('==4242==ERROR: AddressSanitizer: heap-buffer-overflow on address 0x602000000%03x at pc 0x4%05x bp 0x7ffd sp 0x7ffd\n' % (bug, bug))
+    out.write('%s of size 4 at 0x602000000%03x thread T0\n' % ('READ' if bug % 2 else 'WRITE', bug))
+    frames = ['bug%d' % bug, 'parse_chunk%d' % (bug % 7), 'parse', 'LLVMFuzzerTestOneInput', 'main']
+    for i, f in enumerate(frames):
+        out.write('    #%d 0x%x in %s /src/bug%d.c:%d:3\n' % (i, 0x401000 + bug * 0x100 + i * 0x10, f, bug, 10 + i))
+    out.write('    #5 0x7f0000029d90 in __libc_start_main /lib/x86_64-linux-gnu/libc.so.6\n\n')
+    out.write('SUMMARY: AddressSanitizer: heap-buffer-overflow /src/bug%d.c:10:3 in bug%d\n' % (bug, bug))
+    out.flush()
+    sys.exit(1)
+'''
+
+PLOT_HEADER = "# relative_time, cycles_done, cur_item, corpus_count, pending_total, pending_favs, map_size, saved_crashes, saved_hangs, max_depth, execs_per_sec, total_execs, edges_found"
+
+def gen_crashes(root, rnd):
+    target = os.path.join(root, "fake_target.py")
+    with open(target, "w") as f:
+        f.write(FAKE_TARGET)
+    dirs = []
+    for d in range(args.dirs):
+        crashes = os.path.join(root, "crashes_%d" % d)
+        os.makedirs(crashes, exist_ok=True)
+        # AFL++ drops a README.txt in every crashes dir
+        with open(os.path.join(crashes, "README.txt"), "w") as f:
+            f.write("Command line used to find these crashes:\n\n./target @@\n")
+        for i in range(args.testcases):
+            r = rnd.random()
+            kind = "hang" if r < args.hangs else ("ubsan" if r < args.hangs + args.ubsan else "asan")
+            # a few bugs are hit much more often than the others, as in a real campaign
+            bug = min(int(rnd.expovariate(5 / args.bugs)), args.bugs - 1)
+            sig = "00" if kind == "ubsan" else "06"
+            name = "id:%06d,sig:%s,src:%06d,time:%d,execs:%d,op:havoc,rep:%d" % (i, sig, rnd.randrange(max(1, i)), i * 997 + rnd.randrange(997), i * 4096, rnd.choice((2, 4, 8, 16)))
+            with open(os.path.join(crashes, name), "wb") as f:
+                f.write(("%s %d %d\n" % (kind, bug, args.output_kb)).encode() + rnd.randbytes(rnd.randrange(16, 1024)))
+        dirs.append(crashes)
+    return target, dirs
+
+def gen_archives(root, rnd):
+    exp = os.path.join(root, "experiment")
+    os.makedirs(exp, exist_ok=True)
+    for a in range(args.archives):
+        name = ("baseline_%d" if a % 2 == 0 else "run_%d") % (a // 2)
+        corpus, crashes, edges, t = 1, 0, 10, 0
+        rows = [PLOT_HEADER]
+        for i in range(args.plot_rows):
+            t += rnd.randrange(1, 10)
+            corpus += rnd.random() < 0.05
+            crashes += rnd.random() < 0.001
+            edges += rnd.random() < 0.1
+            rows.append("%d, %d, %d, %d, %d, 0, %.2f%%, %d, 0, %d, %.2f, %d, %d" % (t, i // 5000, i % corpus, corpus, corpus // 3, edges / 655.36, crashes, 2 + corpus // 50, rnd.uniform(500, 1500), t * 1000, edges))
+        stats = [("start_time", 1700000000), ("last_update", 1700000000 + t), ("run_time", t), ("fuzzer_pid", 4242),
+                 ("cycles_done", args.plot_rows // 5000), ("cycles_wo_finds", rnd.randrange(5)), ("execs_done", t * 1000),
+                 ("execs_per_sec", "%.2f" % rnd.uniform(500, 1500)), ("corpus_count", corpus), ("corpus_favored", corpus // 4),
+                 ("corpus_found", corpus - 1), ("max_depth", 2 + corpus // 50), ("pending_favs", 0), ("pending_total", corpus // 3),
+                 ("stability", "%.2f%%" % rnd.uniform(95, 100)), ("bitmap_cvg", "%.2f%%" % (edges / 655.36)),
+                 ("saved_crashes", crashes), ("saved_hangs", 0), ("edges_found", edges), ("total_edges", 65536),
+                 ("testcache_size", 1 << 20), ("testcache_count", corpus), ("target_mode", "shmem_testcase default"),
+                 ("afl_banner", "target"), ("afl_version", "++4.08c")]
+        with ZipFile(os.path.join(exp, name + ".zip"), "w", ZIP_DEFLATED) as z:
+            z.writestr("out/default/fuzzer_stats", "".join("%-18s: %s\n" % kv for kv in stats))
+            z.writestr("out/default/plot_data", "\n".join(rows) + "\n")
+            z.writestr("out/default/crashes/README.txt", "Command line used to find these crashes:\n")
+    return exp
+
+def run_tool(argv):
+    # wall time, peak RSS (KiB) of the tool and its children, exit code
+    t = time.perf_counter()
+    p = subprocess.Popen(argv, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    _, status, usage = os.wait4(p.pid, 0)
+    p.returncode = os.waitstatus_to_exitcode(status)
+    return time.perf_counter() - t, usage.ru_maxrss, p.returncode
+
+def median(l):
+    l = sorted(l)
+    return l[len(l) // 2] if len(l) % 2 else (l[len(l) // 2 - 1] + l[len(l) // 2]) / 2
+
+def bench(name, argv, work_key, root, target=[]):
+    # every run saves its --profile-out, the phases and counts of the median run are reported
+    runs = []
+    for i in range(args.repeat):
+        prof = os.path.join(root, "profile_%s_%d.json" % (name.replace(" ", "_"), i))
+        # triage.py takes everything after the target as target arguments
+        wall, rss, code = run_tool(argv + ["--profile-out", prof] + target)
+        if code != 0:
+            print("[error] " + name + " exited with " + str(code) + ": " + " ".join(argv))
+            sys.exit(1)
+        with open(prof) as f:
+            runs.append((wall, rss, json.load(f)))
+    runs.sort(key=lambda r: r[0])
+    wall, rss, prof = runs[len(runs) // 2]
+    work = prof["counts"].get(work_key, 0)
+    res = {"wall": median([r[0] for r in runs]), "walls": [r[0] for r in runs], "peak_rss_kb": max(r[1] for r in runs),
+           "work": work, "throughput": work / wall if wall > 0 else 0.0,
+           "phases": dict((p, v["wall"]) for p, v in prof["phases"].items()), "counts": prof["counts"]}
+    if "latencies" in prof and prof["latencies"]:
+        lat = sorted(prof["latencies"])
+        res["latency_ms"] = {"p50": lat[len(lat) // 2] * 1000, "p99": lat[min(len(lat) - 1, int(0.99 * len(lat)))] * 1000}
+    print(OKGREEN + " >>>> " + name + ENDC)
+    print("Wall time (median of %d) : %.3f s" % (args.repeat, res["wall"]))
+    print("Throughput               : %.1f %s/s" % (res["throughput"], work_key))
+    print("Peak RSS                 : %.1f MiB" % (res["peak_rss_kb"] / 1024))
+    if "latency_ms" in res:
+        print("Replay latency           : p50 %.2f ms, p99 %.2f ms" % (res["latency_ms"]["p50"], res["latency_ms"]["p99"]))
+    for p, w in res["phases"].items():
+        print("  " + p.ljust(28) + ("%.3f s" % w).rjust(10))
+    print()
+    return res
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "-C", dir_path, "rev-parse", "HEAD"], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+root = args.workdir or tempfile.mkdtemp(prefix="triage_bench_")
+os.makedirs(root, exist_ok=True)
+rnd = random.Random(args.seed)
+results = {}
+try:
+    if args.only in (None, "triage"):
+        print(OKBLUE + " >>>> Generating " + str(args.dirs * args.testcases) + " testcases in " + root + ENDC)
+        target, dirs = gen_crashes(root, rnd)
+        argv = [sys.executable, os.path.join(dir_path, "triage.py"), "-q", "-p", str(args.jobs), "--timeout", str(args.timeout)]
+        for d in dirs:
+            argv += ["-i", d]
+        results["triage"] = bench("triage", argv, "testcases", root, [sys.executable, target, "@@"])
+
+    if args.only in (None, "analyzer"):
+        print(OKBLUE + " >>>> Generating " + str(args.archives) + " archives of " + str(args.plot_rows) + " plot_data rows in " + root + ENDC)
+        exp = gen_archives(root, rnd)
+        report = os.path.join(root, "report")
+        cache = os.path.join(root, "cache")
+        argv = [sys.executable, os.path.join(dir_path, "analyzer.py"), exp, "--report", report, "-j", str(args.jobs)]
+        results["analyzer"] = bench("analyzer", argv, "rows parsed", root)
+        results["analyzer tables only"] = bench("analyzer tables only", argv + ["--figures", ""], "rows parsed", root)
+        # a first untimed run fills the cache
+        shutil.rmtree(cache, ignore_errors=True)
+        run_tool(argv + ["--figures", "", "--cache", cache])
+        results["analyzer cached"] = bench("analyzer cached", argv + ["--figures", "", "--cache", cache], "rows parsed", root)
+finally:
+    if args.workdir is None:
+        shutil.rmtree(root, ignore_errors=True)
+
+if args.history is not None:
+    with open(args.history, "a") as f:
+        f.write(json.dumps({"date": datetime.datetime.now().isoformat(timespec="seconds"), "commit": git_commit(),
+                            "config": vars(args), "results": results}) + "\n")
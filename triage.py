@@ -24,11 +24,31 @@
   SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 '''
 
+from concurrent.futures import ThreadPoolExecutor, Future
+from functools import partial
+from collections import deque
+from zipfile import ZipFile
+import contextlib
 import subprocess
 #import progressbar
 import argparse
+import tempfile
+import ctypes
+import struct
+import signal
+import atexit
+import hashlib
+import cProfile
+import selectors
+import select
+import threading
+import sqlite3
 import shutil
+import queue
 import json
+import re
+import csv
+import time
 import sys
 import os
 
@@ -48,7 +68,7 @@ Copyright (C) 2020 Andrea Fioraldi <andreafioraldi@gmail.com>
 dir_path = os.path.dirname(os.path.realpath(__file__))
 
 opt = argparse.ArgumentParser(description=DESCR, formatter_class=argparse.RawTextHelpFormatter)
-opt.add_argument('-i', action='append', help="Input directory with crashes", required=True)
+opt.add_argument('-i', action='append', help="Input directory with crashes, or zipped AFL++ output directory", required=True)
 opt.add_argument("-q", help="Be quiet", action='store_true')
 opt.add_argument("-t", help="Sort by time not by size", action='store_true')
 opt.add_argument("-s", help="Show program output runned with the minimized set", action='store_true')
@@ -58,46 +78,346 @@ opt.add_argument("-n", help="Specify the number of addresses from the top of the
 opt.add_argument("-j", help="Save a bugs summary in json", action='store')
 opt.add_argument("-r", help="Show bugs resume", action='store_true')
 opt.add_argument("-R", help="Show bugs resume with stacktrace", action='store_true')
+opt.add_argument("-p", "--jobs", help="Number of testcases to replay in parallel", action='store', type=int, default=1)
+opt.add_argument("--cache", help="SQLite file caching sanitizer results across runs", action='store')
+opt.add_argument("--clear-cache", help="Invalidate the results cache before running", action='store_true')
+opt.add_argument("--timeout", help="Seconds before a testcase is killed and reported as a hang (0 disables)", action='store', type=float, default=30)
+opt.add_argument("--max-output", help="Bytes of target output to read before killing it (0 disables)", action='store', type=int, default=64 << 20)
+opt.add_argument("--forkserver", help="Replay through the AFL++ forkserver of an instrumented target", action='store_true')
+opt.add_argument("--defer-symbolize", help="Run targets with symbolize=0 and symbolize only the reported stacktraces", action='store_true')
+opt.add_argument("--watch", help="Keep triaging new files in the input directories, STATE keeps the progress across restarts", action='store', metavar="STATE")
+opt.add_argument("--watch-interval", help="Seconds between directory rescans when inotify is not available", action='store', type=float, default=5)
+opt.add_argument("--intersections", help="Save the bug overlap between directories (CSV, or JSON if the name ends in .json)", action='store')
+opt.add_argument("--jsonl", help="Append the result of every testcase to a json-lines file", action='store')
+opt.add_argument("--resume", help="Continue an interrupted run from the --jsonl file", action='store_true')
+opt.add_argument("--minimize", help="Minimize the testcase of every bug with delta debugging and save it in this directory", action='store')
+opt.add_argument("--sig", help="Only triage testcases whose AFL++ sig: is in this comma separated list", action='store')
+opt.add_argument("--min-time", help="Only triage testcases found at least this many seconds into the campaign (AFL++ time:)", action='store', type=float)
+opt.add_argument("--max-time", help="Only triage testcases found at most this many seconds into the campaign (AFL++ time:)", action='store', type=float)
+opt.add_argument("--min-size", help="Only triage testcases of at least this many bytes", action='store', type=int)
+opt.add_argument("--max-size", help="Only triage testcases of at most this many bytes", action='store', type=int)
+opt.add_argument("--order", help="Replay the testcases by size or by time: instead of directory order", action='store', choices=["size", "time"])
+opt.add_argument("--profile", help="Print the time spent in each phase, counters and the replay latency histogram", action='store_true')
+opt.add_argument("--profile-out", help="Save the profile (JSON if the name ends in .json, cProfile stats otherwise), implies --profile", action='store')
 opt.add_argument('target', nargs=argparse.REMAINDER, help="Target program (and arguments)")
 
 args = opt.parse_args()
+if args.resume and args.jsonl is None:
+    opt.error("--resume requires --jsonl")
+if args.watch and not all(os.path.isdir(d) for d in args.i):
+    opt.error("--watch can only follow directories")
 
 be_quiet = args.q
+sigs = None
+if args.sig is not None:
+    sigs = set(int(sig) for sig in args.sig.split(","))
+time_window = args.min_time is not None or args.max_time is not None
 
 os.environ["ASAN_OPTIONS"] = "detect_leaks=0:handle_segv=2:handle_sigill=2:handle_abort=2:handle_sigfpe=2"
+if args.defer_symbolize:
+    os.environ["ASAN_OPTIONS"] += ":symbolize=0"
 
-def get_testcase_time(path):
-    if "time:" in path:
-        p = path[path.find("time:")+5:]
-        t = ""
-        for c in p:
-            if c.isdigit(): t += c
-            else: break
-        return int(t)
-    stat = os.stat(path)
+def children_cpu():
+    t = os.times()
+    return t.children_user + t.children_system
+
+class Profile(object):
+    # with --profile off every hook is a no-op and nothing is wrapped
+    def __init__(self, enabled, out=None):
+        self.enabled = enabled
+        self.out = out
+        self.phases = {}
+        self.counts = {}
+        self.latencies = []
+        self.lock = threading.Lock()
+        self.start = time.perf_counter()
+        self.cprofile = None
+        if out is not None and not out.endswith(".json"):
+            self.cprofile = cProfile.Profile()
+            self.cprofile.enable()
+
+    def phase(self, name):
+        if not self.enabled:
+            return contextlib.nullcontext()
+        return self.timed_phase(name)
+
+    @contextlib.contextmanager
+    def timed_phase(self, name):
+        wall, cpu, children = time.perf_counter(), time.process_time(), children_cpu()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - wall, time.process_time() - cpu, children_cpu() - children)
+
+    def add(self, name, wall, cpu=0.0, children=0.0):
+        with self.lock:
+            p = self.phases.setdefault(name, [0.0, 0.0, 0.0, 0])
+            p[0] += wall
+            p[1] += cpu
+            p[2] += children
+            p[3] += 1
+
+    def count(self, name, n=1):
+        if not self.enabled:
+            return
+        with self.lock:
+            self.counts[name] = self.counts.get(name, 0) + n
+
+    def iterate(self, name, it):
+        # time spent waiting for every item of it
+        if not self.enabled:
+            return it
+        return self.timed_iterate(name, it)
+
+    def timed_iterate(self, name, it):
+        it = iter(it)
+        while True:
+            with self.timed_phase(name):
+                try:
+                    item = next(it)
+                except StopIteration:
+                    return
+            yield item
+
+    def timed_replayer(self, replayer):
+        def timed(path):
+            t = time.perf_counter()
+            try:
+                return replayer(path)
+            finally:
+                with self.lock:
+                    self.latencies.append(time.perf_counter() - t)
+        return timed
+
+    def timed_feed(self, feed):
+        def timed(parser, data):
+            t = time.perf_counter()
+            feed(parser, data)
+            self.add("output parsing (in replay)", time.perf_counter() - t)
+            self.count("target output bytes", len(data))
+        return timed
+
+    def histogram(self):
+        # power of two buckets in milliseconds
+        buckets = {}
+        for lat in self.latencies:
+            edge = 1
+            while edge < lat * 1000:
+                edge *= 2
+            buckets[edge] = buckets.get(edge, 0) + 1
+        return sorted(buckets.items())
+
+    def percentile(self, q):
+        lat = sorted(self.latencies)
+        return lat[min(len(lat) - 1, int(q * len(lat)))] * 1000
+
+    def finish(self):
+        if self.cprofile is not None:
+            self.cprofile.disable()
+            self.cprofile.dump_stats(self.out)
+        total = time.perf_counter() - self.start
+        print(OKBLUE + " >>>> Profile" + ENDC)
+        print("Phase".ljust(28) + "Wall (s)".rjust(10) + "CPU (s)".rjust(10) + "Targets CPU (s)".rjust(17) + "Calls".rjust(9))
+        for name, (wall, cpu, children, calls) in self.phases.items():
+            print(name.ljust(28) + ("%.3f" % wall).rjust(10) + ("%.3f" % cpu).rjust(10) + ("%.3f" % children).rjust(17) + str(calls).rjust(9))
+        print("total".ljust(28) + ("%.3f" % total).rjust(10) + ("%.3f" % time.process_time()).rjust(10) + ("%.3f" % children_cpu()).rjust(17))
+        for name, n in self.counts.items():
+            print(name + " : " + str(n))
+        if self.latencies:
+            print("Replay latency (ms) of %d replays: p50 %.2f p90 %.2f p99 %.2f max %.2f" % (len(self.latencies), self.percentile(0.5), self.percentile(0.9), self.percentile(0.99), max(self.latencies) * 1000))
+            hist = self.histogram()
+            top = max(n for _, n in hist)
+            for edge, n in hist:
+                print(("<= %d ms" % edge).rjust(12) + " : " + str(n).rjust(7) + " " + "#" * max(1, n * 40 // top))
+        print()
+        if self.out is not None and self.cprofile is None:
+            with open(self.out, "w") as f:
+                json.dump({"total_wall": total, "total_cpu": time.process_time(), "targets_cpu": children_cpu(),
+                           "phases": dict((name, {"wall": p[0], "cpu": p[1], "targets_cpu": p[2], "calls": p[3]}) for name, p in self.phases.items()),
+                           "counts": self.counts, "latencies": self.latencies,
+                           "latency_histogram_ms": dict((str(edge), n) for edge, n in self.histogram())}, f)
+
+profile = Profile(args.profile or args.profile_out is not None, args.profile_out)
+if profile.enabled:
+    atexit.register(profile.finish)
+
+# testcases inside zip archives, path -> (ZipFile, ZipInfo)
+archive_members = {}
+# listed testcases, path -> (size, time), nothing is stat'ed twice
+testcase_info = {}
+
+# id:000012,sig:06,src:000003,time:51234,execs:1024,op:havoc,rep:4
+AFL_FIELD = re.compile(r"([a-z]+):([^,]*)")
+
+def afl_fields(name):
+    if not name.startswith("id:"):
+        return {}
+    return dict(AFL_FIELD.findall(name))
+
+def is_testcase(name):
+    # AFL++ writes a README.txt in every crashes dir
+    return name != "README.txt" and not name.startswith(".")
+
+def stat_time(st):
     try:
-        return stat.st_birthtime
+        return st.st_birthtime
     except AttributeError:
-        return stat.st_mtime
+        return st.st_mtime
+
+def ingest(path, name, size, ftime):
+    # records the metadata of a testcase, False if the filters drop it
+    fields = afl_fields(name)
+    found = int(fields["time"]) if fields.get("time", "").isdigit() else None
+    testcase_info[path] = (size, ftime if found is None else found)
+    if sigs is not None and not (fields.get("sig", "").isdigit() and int(fields["sig"]) in sigs):
+        return False
+    if time_window:
+        if found is None:
+            return False
+        if args.min_time is not None and found < args.min_time * 1000:
+            return False
+        if args.max_time is not None and found > args.max_time * 1000:
+            return False
+    if args.min_size is not None and size < args.min_size:
+        return False
+    if args.max_size is not None and size > args.max_size:
+        return False
+    return True
+
+def scan_testcases(dirpath, skip=()):
+    # one pass over the directory, the stat of each entry gives both size and time
+    paths = []
+    with os.scandir(dirpath) as it:
+        for e in it:
+            if e.name in skip or not is_testcase(e.name) or not e.is_file():
+                continue
+            st = e.stat()
+            if ingest(e.path, e.name, st.st_size, stat_time(st)):
+                paths.append(e.path)
+    return paths
+
+def list_testcases(dirpath):
+    if os.path.isdir(dirpath):
+        paths = scan_testcases(dirpath)
+    else:
+        zf = ZipFile(dirpath)
+        paths = []
+        for info in zf.infolist():
+            if info.is_dir() or "crashes" not in info.filename.split("/")[:-1]:
+                continue
+            name = info.filename.rsplit("/", 1)[-1]
+            if not is_testcase(name):
+                continue
+            path = os.path.join(dirpath, info.filename)
+            archive_members[path] = (zf, info)
+            if ingest(path, name, info.file_size, time.mktime(info.date_time + (0, 0, -1))):
+                paths.append(path)
+    if args.order == "size":
+        paths.sort(key=lambda path: testcase_info[path][0])
+    elif args.order == "time":
+        paths.sort(key=lambda path: testcase_info[path][1])
+    return paths
+
+def open_testcase(path):
+    if path in archive_members:
+        zf, info = archive_members[path]
+        return zf.open(info)
+    return open(path, "rb")
+
+def read_testcase(path):
+    with open_testcase(path) as f:
+        return f.read()
+
+def testcase_size(path):
+    if path in testcase_info:
+        return testcase_info[path][0]
+    if path in archive_members:
+        return archive_members[path][1].file_size
+    return os.path.getsize(path)
 
-def run(argv, stdin_file=None, print_output=False):
+def get_testcase_time(path):
+    if path in testcase_info:
+        return testcase_info[path][1]
+    fields = afl_fields(os.path.basename(path))
+    if fields.get("time", "").isdigit():
+        return int(fields["time"])
+    if path in archive_members:
+        return time.mktime(archive_members[path][1].date_time + (0, 0, -1))
+    return stat_time(os.stat(path))
+
+def run(argv, stdin_file=None, parser=None):
+    # feeds the target output to parser, returns True if the target hanged
+    content = b""
     if stdin_file:
-        with open(stdin_file, "rb") as f:
-            content = f.read()
-    if print_output:
-        p = subprocess.Popen(argv, stdin=subprocess.PIPE, close_fds=True)
-        if stdin_file:
-            p.stdin.write(content)
+        content = read_testcase(stdin_file)
+    p = subprocess.Popen(argv, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, close_fds=True)
+    deadline = None
+    if args.timeout > 0:
+        deadline = time.monotonic() + args.timeout
+    sel = selectors.DefaultSelector()
+    sel.register(p.stdout, selectors.EVENT_READ)
+    if content:
+        os.set_blocking(p.stdin.fileno(), False)
+        sel.register(p.stdin, selectors.EVENT_WRITE)
     else:
-        p = subprocess.Popen(argv, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, close_fds=True)
-        if stdin_file:
-            p.stdin.write(content)
-        while(True):
-            retcode = p.poll()
-            yield p.stdout.readline()
-            if retcode is not None:
-                break
-    p.wait()
+        p.stdin.close()
+    written = 0
+    read = 0
+    hang = False
+    stop = False
+    try:
+        while sel.get_map() and not stop and not parser.finished():
+            remaining = None
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    # with -s a complete report is not a hang, the target just did not exit
+                    hang = not parser.done
+                    break
+            for key, _ in sel.select(remaining):
+                if key.fileobj is p.stdin:
+                    try:
+                        written += os.write(p.stdin.fileno(), content[written:written + (1 << 16)])
+                    except BrokenPipeError:
+                        written = len(content)
+                    if written >= len(content):
+                        sel.unregister(p.stdin)
+                        p.stdin.close()
+                    continue
+                data = os.read(p.stdout.fileno(), 1 << 16)
+                if not data:
+                    sel.unregister(p.stdout)
+                    continue
+                read += len(data)
+                parser.feed(data)
+                if args.max_output > 0 and read >= args.max_output:
+                    hang = not parser.done
+                    stop = True
+                    break
+        if not hang and not stop and not parser.done and p.poll() is None:
+            # the target closed its output but is still running
+            try:
+                p.wait(None if deadline is None else max(0, deadline - time.monotonic()))
+            except subprocess.TimeoutExpired:
+                hang = True
+    finally:
+        sel.close()
+        if p.poll() is None:
+            p.kill()
+        p.wait()
+        p.stdout.close()
+        if not p.stdin.closed:
+            p.stdin.close()
+    parser.close()
+    return hang
+
+def show_output(ref):
+    if ref is None:
+        warn("output not available, the testcase was triaged by a previous run")
+        return
+    sys.stdout.flush()
+    sys.stdout.buffer.write(outputs.get(ref))
+    sys.stdout.buffer.flush()
 
 def warn(x):
     global be_quiet
@@ -113,195 +433,1084 @@ def log_progress(x):
         return progressbar.progressbar(x)
 
 class UbsanCrash(object):
-    def __init__(self, type_, loc, path, size):
+    __slots__ = ("type", "loc", "path", "size", "output", "time")
+    def __init__(self, type_, loc, path, size, output=None, time_=None):
         self.type = type_
         self.loc = loc
         self.path = path
         self.size = size
-        self.time = get_testcase_time(path)
+        self.output = output
+        self.time = get_testcase_time(path) if time_ is None else time_
     def __hash__(self):
         return hash(self.loc)
     def __eq__(self, o):
         return self.loc == o.loc
 
 class AsanCrash(object):
-    def __init__(self, type_, trace, loc, path, size):
+    __slots__ = ("type", "trace", "size", "loc", "path", "output", "time")
+    def __init__(self, type_, trace, loc, path, size, output=None, time_=None):
         self.type = type_
         self.trace = trace
         self.size = size
         self.loc = loc
         self.path = path
-        self.time = get_testcase_time(path)
+        self.output = output
+        self.time = get_testcase_time(path) if time_ is None else time_
     def __hash__(self):
         return hash(tuple(self.trace))
     def __eq__(self, o):
         return self.trace == o.trace
 
+class OutputStore(object):
+    # small outputs stay in memory, the others are spilled to a temporary file
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.spill = None
+    def put(self, data):
+        if data is None:
+            return None
+        if len(data) <= OUTPUT_INLINE:
+            return bytes(data)
+        with self.lock:
+            if self.spill is None:
+                self.spill = tempfile.TemporaryFile()
+            offset = self.spill.seek(0, os.SEEK_END)
+            self.spill.write(data)
+        return (offset, len(data))
+    def get(self, ref):
+        if isinstance(ref, bytes):
+            return ref
+        offset, size = ref
+        with self.lock:
+            self.spill.seek(offset)
+            return self.spill.read(size)
+
+OUTPUT_INLINE = 1 << 16
+MAX_LINE = 1 << 12
+
+outputs = OutputStore()
+
+class Bucket(object):
+    # only the best testcase of a bug is kept, the others are just counted
+    __slots__ = ("best", "count")
+    def __init__(self, crash):
+        self.best = keep_output(crash)
+        self.count = 1
+    def add(self, crash):
+        self.count += 1
+        if args.t:
+            if crash.time < self.best.time:
+                self.best = keep_output(crash)
+        elif crash.size < self.best.size:
+            self.best = keep_output(crash)
+
+def keep_output(crash):
+    # only the representatives of the buckets have their output stored
+    crash.output = outputs.put(crash.output)
+    return crash
+
+def add_crash(bugs, key, crash):
+    if key in bugs:
+        bugs[key].add(crash)
+    else:
+        bugs[key] = Bucket(crash)
+
+class ReportParser(object):
+    def __init__(self, keep_output=False):
+        self.output = bytearray() if keep_output else None
+        self.pending = bytearray()
+        self.start_asan = False
+        self.in_asan = False
+        self.in_trace = True
+        self.asan_type = ""
+        self.memaccess = ''
+        self.stacktrace = []
+        self.ubsan = []
+        self.done = False
+    def finished(self):
+        # when the output is kept for -s the target runs to the end
+        return self.done and self.output is None
+    def feed(self, data):
+        if self.output is not None:
+            self.output += data
+        # only the new data is searched, the unfinished line is never copied again
+        start = 0
+        while not self.done:
+            end = data.find(b"\n", start)
+            if end < 0:
+                break
+            if self.pending:
+                self.pending += data[start:end + 1]
+                self.feed_line(bytes(self.pending))
+                del self.pending[:]
+            else:
+                self.feed_line(data[start:end + 1])
+            start = end + 1
+        if not self.done:
+            self.pending += data[start:]
+            # report lines are short, the rest of a huge line is never needed
+            del self.pending[MAX_LINE:]
+    def close(self):
+        if self.pending and not self.done:
+            self.feed_line(bytes(self.pending))
+        del self.pending[:]
+    def feed_line(self, l):
+        if l.startswith(b"================================================================="):
+            self.start_asan = True
+            self.in_asan = True
+        elif self.start_asan and b"ERROR: AddressSanitizer:" in l:
+            l = l[l.find(b"ERROR: AddressSanitizer: ") + len(b"ERROR: AddressSanitizer: "):]
+            self.asan_type = l.decode("utf-8")
+        elif self.start_asan and b"ERROR: QEMU-AddressSanitizer:" in l:
+            l = l[l.find(b"ERROR: QEMU-AddressSanitizer: ") + len(b"ERROR: QEMU-AddressSanitizer: "):]
+            self.asan_type = l.decode("utf-8")
+        elif self.start_asan and l.startswith(b'READ'):
+            self.memaccess = 'read'
+        elif self.start_asan and l.startswith(b'WRITE'):
+            self.memaccess = 'write'
+        elif (self.start_asan or self.in_trace) and l.startswith(b"    #"):
+            self.in_trace = True
+            self.start_asan = False
+            ls = l.split()
+            if b'libstdc++' not in l and b'/libc.' not in l and b'glibc' not in l:
+                self.stacktrace.append((int(ls[1], 0), (b" ".join(ls[1:])).decode("utf-8")))
+        elif self.in_trace:
+            self.in_trace = False
+            # the crash stacktrace is all we need from an ASan report
+            if self.in_asan and len(self.stacktrace) > 0:
+                self.done = True
+        elif b": runtime error: " in l:
+            l = l.split(b": runtime error: ")
+            self.ubsan.append((l[1].decode("utf-8"), l[0].decode("utf-8")))
+    def result(self, hang=False):
+        output = None
+        if self.output is not None:
+            output = bytes(self.output)
+        return self.asan_type, self.memaccess, self.stacktrace, self.ubsan, hang, output
+
+if profile.enabled:
+    ReportParser.feed = profile.timed_feed(ReportParser.feed)
+
+def frame_key(frame):
+    # the pc changes with ASLR, the module+offset (symbolize=0) or the function and line do not
+    key = Symbolizer.module_offset(frame[1])
+    if key is not None:
+        return "%s+0x%x" % key
+    _, _, where = frame[1].partition(" in ")
+    return where or frame[0]
+
 def callstack_hash(s):
     l = list(s)
     if args.n >= 0:
         l = l[0:args.n]
     h = 0
     for a in l:
-        h ^= a[0]
+        k = frame_key(a)
+        if isinstance(k, str):
+            k = int.from_bytes(hashlib.sha1(k.encode()).digest()[:8], "little")
+        h ^= k
     return h
 
+class Symbolizer(object):
+    def __init__(self):
+        self.frames = {}
+        self.proc = None
+        self.tool = os.environ.get("ASAN_SYMBOLIZER_PATH") or shutil.which("llvm-symbolizer")
+        if self.tool is None and shutil.which("addr2line") is None:
+            warn("neither llvm-symbolizer nor addr2line found, stacktraces stay unsymbolized")
+
+    @staticmethod
+    def module_offset(rep):
+        # unsymbolized frames look like "0x55d4 (/path/to/module+0x29ee)"
+        if not rep.endswith(")") or "(" not in rep:
+            return None
+        module, _, offset = rep[rep.rfind("(") + 1:-1].rpartition("+")
+        if not module or not offset.startswith("0x"):
+            return None
+        # ASan already prints the pc of the call instruction, not the return address
+        return module, int(offset, 16)
+
+    def query_llvm(self, module, offset):
+        if self.proc is None:
+            self.proc = subprocess.Popen([self.tool, "--inlining", "--demangle"], stdin=subprocess.PIPE,
+                                         stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, close_fds=True)
+        self.proc.stdin.write(('"%s" 0x%x\n' % (module, offset)).encode())
+        self.proc.stdin.flush()
+        lines = []
+        while True:
+            l = self.proc.stdout.readline()
+            if not l or l == b"\n":
+                break
+            lines.append(l.decode("utf-8", "replace").strip())
+        return list(zip(lines[0::2], lines[1::2]))
+
+    def query_addr2line(self, module, offsets):
+        out = subprocess.run(["addr2line", "-a", "-f", "-C", "-i", "-e", module] + ["0x%x" % o for o in offsets],
+                             stdout=subprocess.PIPE, stderr=subprocess.DEVNULL).stdout.decode("utf-8", "replace")
+        results = {}
+        cur = None
+        lines = out.splitlines()
+        i = 0
+        while i < len(lines):
+            if lines[i].startswith("0x"):
+                cur = int(lines[i], 16)
+                results[cur] = []
+                i += 1
+            elif cur is not None and i + 1 < len(lines):
+                results[cur].append((lines[i], lines[i + 1].split(" (discriminator")[0]))
+                i += 2
+            else:
+                break
+        return results
+
+    def symbolize(self, crashes):
+        todo = set()
+        for crash in crashes:
+            for addr, rep in crash.trace:
+                key = self.module_offset(rep)
+                if key is not None and key not in self.frames:
+                    todo.add(key)
+        if self.tool is not None:
+            for module, offset in sorted(todo):
+                self.frames[(module, offset)] = self.query_llvm(module, offset)
+        elif shutil.which("addr2line") is not None:
+            modules = {}
+            for module, offset in todo:
+                modules.setdefault(module, []).append(offset)
+            for module, offsets in modules.items():
+                res = self.query_addr2line(module, sorted(offsets))
+                for offset in offsets:
+                    self.frames[(module, offset)] = res.get(offset, [])
+        for crash in crashes:
+            crash.trace = self.symbolize_trace(crash.trace)
+            crash.loc = crash.trace[0][1]
+
+    def symbolize_trace(self, trace):
+        # render frames the way ASan does, inlined calls become extra frames
+        out = []
+        for addr, rep in trace:
+            key = self.module_offset(rep)
+            frames = [f for f in self.frames.get(key, []) if f[0] != "??"]
+            if not frames:
+                out.append((addr, rep))
+                continue
+            pc = rep.split()[0]
+            for func, fileline in frames:
+                if fileline.startswith("??"):
+                    out.append((addr, pc + " in " + func + " " + rep[rep.rfind("("):]))
+                else:
+                    out.append((addr, pc + " in " + func + " " + fileline))
+        return out
+
+    def close(self):
+        if self.proc is not None:
+            self.proc.stdin.close()
+            self.proc.wait()
+            self.proc = None
+
+def target_argv(path, staging=None):
+    argv = args.target[:]
+    stdin_file = path
+    for i in range(len(argv)):
+        if argv[i] == "@@":
+            argv[i] = path
+            if staging:
+                with open_testcase(path) as src, open(staging, "wb") as dst:
+                    shutil.copyfileobj(src, dst)
+                argv[i] = staging
+            stdin_file = None
+    return argv, stdin_file
+
+def replay(path, staging=None):
+    argv, stdin_file = target_argv(path, staging)
+    parser = ReportParser(args.s)
+    hang = run(argv, stdin_file, parser)
+    return parser.result(hang)
+
+def classify(result, path, size=None, time_=None):
+    asan_type, memaccess, stacktrace, ubsan, hang, output = result
+    if size is None:
+        size = testcase_size(path)
+    if time_ is None:
+        time_ = get_testcase_time(path)
+    errs = set()
+    for type_, loc in ubsan:
+        errs.add(UbsanCrash(type_, loc, path, size, output, time_))
+    #if len(errs) == 0 and len(stacktrace) == 0:
+        #warn(path + " does not trigger any violation!")
+    asan = None
+    if len(stacktrace) > 0 and not hang:
+        first_st = stacktrace[0]
+        st = frame_key(first_st)
+        etype = asan_type.split()[0]
+        if not args.c and etype != 'ILL':
+            st = callstack_hash(stacktrace)
+        asan = ((st, etype, memaccess), AsanCrash(asan_type, stacktrace, first_st[1], path, size, output, time_))
+    return errs, asan, hang
+
+def file_digest(path):
+    h = hashlib.sha256()
+    with open_testcase(path) as f:
+        for chunk in iter(lambda: f.read(1 << 16), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+class ResultCache(object):
+    def __init__(self, db_path, clear=False):
+        self.db = sqlite3.connect(db_path)
+        self.db.execute("CREATE TABLE IF NOT EXISTS results (testcase TEXT, config TEXT, asan_type TEXT, memaccess TEXT, stacktrace TEXT, ubsan TEXT, hang INTEGER, output BLOB, PRIMARY KEY (testcase, config))")
+        if clear:
+            self.db.execute("DELETE FROM results")
+        self.db.commit()
+        self.config = self.config_digest()
+    def config_digest(self):
+        # anything that can change what the target prints for the same input
+        h = hashlib.sha256()
+        binary = shutil.which(args.target[0]) if args.target else None
+        if binary:
+            h.update(file_digest(binary).encode())
+        h.update(json.dumps([args.target, os.environ.get("ASAN_OPTIONS"), args.n, args.c, args.timeout, args.max_output]).encode())
+        return h.hexdigest()
+    def get(self, digest):
+        row = self.db.execute("SELECT asan_type, memaccess, stacktrace, ubsan, hang, output FROM results WHERE testcase = ? AND config = ?", (digest, self.config)).fetchone()
+        if row is None:
+            return None
+        asan_type, memaccess, stacktrace, ubsan, hang, output = row
+        if output is None and args.s:
+            # replayed without -s before, the output is needed now
+            return None
+        return asan_type, memaccess, [tuple(a) for a in json.loads(stacktrace)], [tuple(u) for u in json.loads(ubsan)], bool(hang), output
+    def put(self, digest, result):
+        asan_type, memaccess, stacktrace, ubsan, hang, output = result
+        self.db.execute("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?, ?, ?)", (digest, self.config, asan_type, memaccess, json.dumps(stacktrace), json.dumps(ubsan), int(hang), output))
+        self.db.commit()
+
+def staging_files(jobs):
+    # every worker needs its own -f copy, keep the extension for the target
+    if not args.f:
+        if "@@" in args.target and not all(os.path.isdir(d) for d in args.i):
+            # archive members need a real file to be passed as @@
+            tmp = tempfile.mkdtemp(prefix="triage_")
+            atexit.register(shutil.rmtree, tmp, True)
+            return [os.path.join(tmp, "input." + str(k)) for k in range(jobs)]
+        return [None] * jobs
+    if jobs == 1:
+        return [args.f]
+    root, ext = os.path.splitext(args.f)
+    return [root + "." + str(k) + ext for k in range(jobs)]
+
+FORKSRV_FD = 198
+FS_OPT_ENABLED = 0x80000001
+FS_OPT_MAPSIZE = 0x40000000
+FS_OPT_AUTODICT = 0x10000000
+FS_OPT_SHDMEM_FUZZ = 0x01000000
+FS_OPT_OLD_AFLPP_WORKAROUND = 0x0f000000
+FS_NEW_VERSION_MIN = 1
+FS_NEW_VERSION_MAX = 1
+FS_NEW_OPT_MAPSIZE = 0x00000001
+FS_NEW_OPT_SHDMEM_FUZZ = 0x00000002
+FS_NEW_OPT_AUTODICT = 0x00000800
+MAX_FILE = 1 << 20
+# seconds a forkserver gets to report the status of a killed child
+FORKSRV_KILL_GRACE = 2
+
+IPC_PRIVATE = 0
+IPC_CREAT = 0o1000
+IPC_EXCL = 0o2000
+IPC_RMID = 0
+
+class ForkserverError(Exception):
+    pass
+
+class Forkserver(object):
+    def __init__(self, staging=None):
+        self.tmp = None
+        if staging is None:
+            fd, staging = tempfile.mkstemp(prefix="triage_")
+            os.close(fd)
+            self.tmp = staging
+        self.staging = staging
+        self.out_fd = os.open(staging, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o600)
+        self.argv = [staging if a == "@@" else a for a in args.target]
+        self.use_stdin = "@@" not in args.target
+        # testcases are also offered in shared memory, for targets built with __AFL_FUZZ_TESTCASE_BUF
+        self.libc = ctypes.CDLL(None, use_errno=True)
+        self.libc.shmat.restype = ctypes.c_void_p
+        self.libc.shmat.argtypes = [ctypes.c_int, ctypes.c_void_p, ctypes.c_int]
+        self.libc.shmdt.argtypes = [ctypes.c_void_p]
+        self.libc.shmctl.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.c_void_p]
+        self.shm_id = self.libc.shmget(IPC_PRIVATE, MAX_FILE + 4, IPC_CREAT | IPC_EXCL | 0o600)
+        if self.shm_id < 0:
+            raise ForkserverError("shmget() failed: " + os.strerror(ctypes.get_errno()))
+        self.shm = self.libc.shmat(self.shm_id, None, 0)
+        if self.shm in (None, ctypes.c_void_p(-1).value):
+            self.libc.shmctl(self.shm_id, IPC_RMID, None)
+            raise ForkserverError("shmat() failed: " + os.strerror(ctypes.get_errno()))
+        self.use_shm = False
+        self.proc = None
+        self.pid = None
+        self.prev_timed_out = 0
+        atexit.register(self.close)
+        self.start()
+
+    def start(self):
+        ctl_r, ctl_w = os.pipe()
+        st_r, st_w = os.pipe()
+        env = dict(os.environ)
+        env["__AFL_SHM_FUZZ_ID"] = str(self.shm_id)
+        # the target expects its ends of the pipes on fixed descriptors
+        os.dup2(ctl_r, FORKSRV_FD)
+        os.dup2(st_w, FORKSRV_FD + 1)
+        try:
+            self.proc = subprocess.Popen(self.argv, stdin=self.out_fd if self.use_stdin else subprocess.DEVNULL,
+                                         stdout=subprocess.PIPE, stderr=subprocess.STDOUT, env=env,
+                                         pass_fds=(FORKSRV_FD, FORKSRV_FD + 1), close_fds=True)
+        finally:
+            for fd in (ctl_r, st_w, FORKSRV_FD, FORKSRV_FD + 1):
+                os.close(fd)
+        self.ctl_fd = ctl_w
+        self.st_fd = st_r
+        os.set_blocking(self.proc.stdout.fileno(), False)
+        self.handshake()
+
+    def read_u32(self, timeout=None):
+        data = b""
+        while len(data) < 4:
+            if timeout is not None:
+                r, _, _ = select.select([self.st_fd], [], [], timeout)
+                if not r:
+                    return None
+            chunk = os.read(self.st_fd, 4 - len(data))
+            if not chunk:
+                raise ForkserverError("forkserver died, is the target instrumented?")
+            data += chunk
+        return struct.unpack("I", data)[0]
+
+    def write_u32(self, value):
+        os.write(self.ctl_fd, struct.pack("I", value))
+
+    def handshake(self):
+        status = self.read_u32(args.timeout if args.timeout > 0 else None)
+        if status is None:
+            raise ForkserverError("timeout waiting for the forkserver hello")
+        if 0x41464c00 <= status <= 0x41464cff:
+            # AFL++ >= 4.20 protocol
+            version = status - 0x41464c00
+            if version < FS_NEW_VERSION_MIN or version > FS_NEW_VERSION_MAX:
+                raise ForkserverError("unsupported forkserver version " + str(version))
+            self.write_u32(status ^ 0xffffffff)
+            options = self.read_u32()
+            if options & FS_NEW_OPT_MAPSIZE:
+                self.read_u32()
+            if options & FS_NEW_OPT_SHDMEM_FUZZ:
+                self.use_shm = True
+            if options & FS_NEW_OPT_AUTODICT:
+                self.read_dict()
+            if self.read_u32() != status:
+                raise ForkserverError("forkserver did not send the correct hello")
+        elif (status & FS_OPT_ENABLED) == FS_OPT_ENABLED and (status & FS_OPT_OLD_AFLPP_WORKAROUND) != FS_OPT_OLD_AFLPP_WORKAROUND:
+            if status & FS_OPT_SHDMEM_FUZZ:
+                self.use_shm = True
+                if not status & FS_OPT_AUTODICT:
+                    self.write_u32(FS_OPT_ENABLED | FS_OPT_SHDMEM_FUZZ)
+            if status & FS_OPT_AUTODICT:
+                self.write_u32(FS_OPT_ENABLED | FS_OPT_AUTODICT | (FS_OPT_SHDMEM_FUZZ if self.use_shm else 0))
+                self.read_dict()
+
+    def read_dict(self):
+        # the autodictionary is useless here but must be consumed
+        size = self.read_u32()
+        while size > 0:
+            chunk = os.read(self.st_fd, size)
+            if not chunk:
+                raise ForkserverError("forkserver died while sending the dictionary")
+            size -= len(chunk)
+
+    def drain(self, parser):
+        read = 0
+        while True:
+            try:
+                data = os.read(self.proc.stdout.fileno(), 1 << 16)
+            except BlockingIOError:
+                return read
+            if not data:
+                return read
+            read += len(data)
+            parser.feed(data)
+
+    def replay(self, path):
+        content = read_testcase(path)
+        if self.use_shm and len(content) > MAX_FILE:
+            return replay(path, self.staging)
+        # a forkserver that died or stopped answering is restarted, if that fails too the testcase runs without it
+        for attempt in range(2):
+            try:
+                if self.proc is None:
+                    self.start()
+                return self.run(content)
+            except (ForkserverError, OSError) as e:
+                warn("forkserver failed on " + path + " (" + str(e) + "), " + ("restarting it" if attempt == 0 else "replaying without it"))
+                profile.count("forkserver restarts")
+                self.stop()
+        return replay(path, self.staging)
+
+    def run(self, content):
+        os.lseek(self.out_fd, 0, os.SEEK_SET)
+        os.write(self.out_fd, content)
+        os.ftruncate(self.out_fd, len(content))
+        os.lseek(self.out_fd, 0, os.SEEK_SET)
+        if self.use_shm:
+            ctypes.memmove(self.shm, struct.pack("I", len(content)) + content, len(content) + 4)
+        self.write_u32(self.prev_timed_out)
+        pid = self.read_u32(args.timeout if args.timeout > 0 else None)
+        if pid is None:
+            raise ForkserverError("timeout waiting for the forkserver to fork")
+        self.pid = pid
+        parser = ReportParser(args.s)
+        deadline = None
+        if args.timeout > 0:
+            deadline = time.monotonic() + args.timeout
+        read = 0
+        hang = False
+        stop = False
+        killed = False
+        status = None
+        while status is None:
+            remaining = None
+            if deadline is not None:
+                remaining = max(0, deadline - time.monotonic())
+            r, _, _ = select.select([self.st_fd, self.proc.stdout.fileno()], [], [], remaining)
+            if not r:
+                if killed:
+                    raise ForkserverError("no status from the forkserver for a killed child")
+                hang = hang or not parser.done
+                stop = True
+            if self.proc.stdout.fileno() in r:
+                read += self.drain(parser)
+                if args.max_output > 0 and read >= args.max_output:
+                    hang = hang or not parser.done
+                    stop = True
+            if (hang or stop or parser.finished()) and not killed:
+                # stop the child, the forkserver then reports its status
+                try:
+                    os.kill(pid, signal.SIGKILL)
+                except ProcessLookupError:
+                    pass
+                killed = True
+                deadline = time.monotonic() + FORKSRV_KILL_GRACE
+            if self.st_fd in r:
+                status = self.read_u32()
+        self.pid = None
+        self.drain(parser)
+        parser.close()
+        self.prev_timed_out = 1 if hang else 0
+        return parser.result(hang)
+
+    def stop(self):
+        # the shared memory and the staging file are kept for a restart
+        if self.pid is not None:
+            try:
+                os.kill(self.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+            self.pid = None
+        if self.proc is not None:
+            self.proc.kill()
+            self.proc.wait()
+            self.proc.stdout.close()
+            os.close(self.ctl_fd)
+            os.close(self.st_fd)
+            self.proc = None
+
+    def close(self):
+        self.stop()
+        if self.shm is not None:
+            self.libc.shmdt(self.shm)
+            self.libc.shmctl(self.shm_id, IPC_RMID, None)
+            self.shm = None
+        if self.out_fd is not None:
+            os.close(self.out_fd)
+            self.out_fd = None
+        if self.tmp is not None:
+            os.unlink(self.tmp)
+            self.tmp = None
+
+def make_replayers(jobs):
+    if args.forkserver:
+        try:
+            return [Forkserver(staging).replay for staging in staging_files(jobs)]
+        except ForkserverError as e:
+            print(FAIL + "[error] " + str(e) + ENDC)
+            sys.exit(1)
+    return [partial(replay, staging=staging) for staging in staging_files(jobs)]
+
+REPLAY_WINDOW = 4
+
+def replay_all(paths, lookup=None):
+    # lookup(path) returns an already known result or None, known results are not replayed
+    if len(replayers) == 1:
+        for path in paths:
+            result = lookup(path) if lookup is not None else None
+            yield replayers[0](path) if result is None else result
+        return
+    slots = queue.Queue()
+    for replayer in replayers:
+        slots.put(replayer)
+    def work(path):
+        replayer = slots.get()
+        try:
+            return replayer(path)
+        finally:
+            slots.put(replayer)
+    # results are yielded in submission order, so buckets are filled as in a serial run;
+    # only a window of futures exists at any time, map() would create one per path up front
+    window = deque()
+    with ThreadPoolExecutor(len(replayers)) as pool:
+        try:
+            for path in paths:
+                result = lookup(path) if lookup is not None else None
+                if result is None:
+                    window.append(pool.submit(work, path))
+                else:
+                    future = Future()
+                    future.set_result(result)
+                    window.append(future)
+                if len(window) >= REPLAY_WINDOW * len(replayers):
+                    yield window.popleft().result()
+            while window:
+                yield window.popleft().result()
+        finally:
+            for future in window:
+                future.cancel()
+
+def triage_all(paths):
+    if cache is None:
+        yield from replay_all(paths)
+        return
+    # digest and cache hit of the looked up paths not yielded yet, in order
+    pending = deque()
+    def lookup(path):
+        with profile.phase("cache lookup (in replay)"):
+            digest = file_digest(path)
+            result = cache.get(digest)
+        pending.append((digest, result is not None))
+        return result
+    # every result is stored and yielded as soon as it is ready, so the journal follows the cache;
+    # a byte-identical testcase hits the cache unless its twin is still in the replay window
+    for result in replay_all(paths, lookup):
+        digest, hit = pending.popleft()
+        if hit:
+            profile.count("cache hits")
+        else:
+            cache.put(digest, result)
+        yield result
+
+def same_bug(kind, key, classified):
+    errs, asan, hang = classified
+    if hang:
+        return False
+    if kind == "ubsan":
+        return any(c.loc == key for c in errs)
+    return asan is not None and asan[0] == key
+
+def ddmin(data, kind, key, tmpdir):
+    # a candidate is kept only if it still falls in the same bucket
+    window = len(replayers)
+    cand_paths = [os.path.join(tmpdir, "cand." + str(k)) for k in range(window)]
+    def first_passing(cands):
+        for i in range(0, len(cands), window):
+            batch = cands[i:i + window]
+            for path, cand in zip(cand_paths, batch):
+                with open(path, "wb") as f:
+                    f.write(cand)
+            results = replay_all(cand_paths[:len(batch)])
+            for j, (path, result) in enumerate(zip(cand_paths, results)):
+                if same_bug(kind, key, classify(result, path, len(batch[j]), 0)):
+                    return batch[j]
+        return None
+    n = 2
+    while len(data) >= 2:
+        chunk = -(-len(data) // n)
+        starts = range(0, len(data), chunk)
+        subsets = [data[i:i + chunk] for i in starts]
+        found = first_passing(subsets)
+        if found is not None:
+            data = found
+            n = 2
+            continue
+        if n > 2:
+            found = first_passing([data[:i] + data[i + chunk:] for i in starts])
+            if found is not None:
+                data = found
+                n = max(n - 1, 2)
+                continue
+        if n >= len(data):
+            break
+        n = min(n * 2, len(data))
+    return data
+
+def minimize_bugs(dir_index, ubsan_bugs, asan_bugs):
+    os.makedirs(args.minimize, exist_ok=True)
+    tmpdir = tempfile.mkdtemp(prefix="triage_min_")
+    try:
+        for kind, bugs in (("ubsan", ubsan_bugs), ("asan", asan_bugs)):
+            for n, key in enumerate(bugs):
+                best = bugs[key].best
+                data = read_testcase(best.path)
+                # a representative that does not reproduce its bucket would never shrink
+                reproduced = same_bug(kind, key, classify(next(replay_all([best.path])), best.path, len(data), 0))
+                if reproduced:
+                    small = ddmin(data, kind, key, tmpdir)
+                else:
+                    warn(best.path + " does not reproduce its bug, copied without minimizing")
+                    small = data
+                out = os.path.join(args.minimize, "%s_%d_%d_%s" % (kind, dir_index, n, os.path.basename(best.path)))
+                with open(out, "wb") as f:
+                    f.write(small)
+                if reproduced and not be_quiet:
+                    print("Minimized " + best.path + " from " + str(len(data)) + " to " + str(len(small)) + " bytes: " + out)
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_TO = 0x80
+
+class Inotify(object):
+    def __init__(self, dirs):
+        self.libc = ctypes.CDLL(None, use_errno=True)
+        self.fd = self.libc.inotify_init1(os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1")
+        self.wds = {}
+        for d in dirs:
+            wd = self.libc.inotify_add_watch(self.fd, os.fsencode(d), IN_CLOSE_WRITE | IN_MOVED_TO)
+            if wd < 0:
+                os.close(self.fd)
+                raise OSError(ctypes.get_errno(), "inotify_add_watch", d)
+            self.wds[wd] = d
+    def wait(self, timeout=None):
+        r, _, _ = select.select([self.fd], [], [], timeout)
+        if not r:
+            return []
+        data = os.read(self.fd, 1 << 16)
+        events = []
+        i = 0
+        while i < len(data):
+            wd, mask, cookie, size = struct.unpack_from("iIII", data, i)
+            name = data[i + 16:i + 16 + size].rstrip(b"\0")
+            i += 16 + size
+            if wd in self.wds and name:
+                events.append((self.wds[wd], os.fsdecode(name)))
+        return events
+    def close(self):
+        os.close(self.fd)
+
+def watch_state(state_path):
+    seen = dict((d, set()) for d in args.i)
+    bugs = dict((d, set()) for d in args.i)
+    if os.path.exists(state_path):
+        with open(state_path) as f:
+            for l in f:
+                e = json.loads(l)
+                if e["dir"] not in seen:
+                    continue
+                if "file" in e:
+                    seen[e["dir"]].add(e["file"])
+                else:
+                    bugs[e["dir"]].add(e["bug"])
+    return seen, bugs
+
+def new_testcases(dirpath, seen):
+    return sorted(os.path.basename(path) for path in scan_testcases(dirpath, seen))
+
+def watch():
+    seen, bugs = watch_state(args.watch)
+    try:
+        notifier = Inotify(args.i)
+    except OSError as e:
+        warn("inotify not available (" + str(e) + "), rescanning every " + str(args.watch_interval) + "s")
+        notifier = None
+    # watches are in place before the scan, so no file can be missed
+    pending = dict((d, new_testcases(d, seen[d])) for d in args.i)
+    state = open(args.watch, "a")
+    try:
+        while True:
+            for dirpath in args.i:
+                paths = [os.path.join(dirpath, fname) for fname in pending[dirpath]]
+                for path, result in zip(paths, triage_all(paths)):
+                    errs, asan, hang = classify(result, path)
+                    found = []
+                    for c in errs:
+                        found.append((json.dumps(["ubsan", c.loc]), "UBSan " + c.type.strip() + " at " + c.loc))
+                    if asan is not None:
+                        key, crash = asan
+                        if symbolizer is not None and json.dumps(["asan", key]) not in bugs[dirpath]:
+                            symbolizer.symbolize([crash])
+                        found.append((json.dumps(["asan", key]), "ASan " + crash.type.split()[0] + " at " + crash.loc))
+                    for bug, descr in found:
+                        if bug in bugs[dirpath]:
+                            continue
+                        bugs[dirpath].add(bug)
+                        state.write(json.dumps({"dir": dirpath, "bug": bug, "path": path}) + "\n")
+                        print(OKGREEN + "[new bug] " + dirpath + ": " + descr + " (" + path + ")" + ENDC)
+                    if hang:
+                        warn(path + " hangs (timeout or output limit reached)")
+                    seen[dirpath].add(os.path.basename(path))
+                    state.write(json.dumps({"dir": dirpath, "file": os.path.basename(path)}) + "\n")
+                state.flush()
+                sys.stdout.flush()
+            if notifier is not None:
+                events = notifier.wait()
+                pending = dict((d, []) for d in args.i)
+                for dirpath, fname in events:
+                    if fname in seen[dirpath] or fname in pending[dirpath] or not is_testcase(fname):
+                        continue
+                    path = os.path.join(dirpath, fname)
+                    try:
+                        st = os.stat(path)
+                    except OSError:
+                        continue
+                    if ingest(path, fname, st.st_size, stat_time(st)):
+                        pending[dirpath].append(fname)
+            else:
+                time.sleep(args.watch_interval)
+                pending = dict((d, new_testcases(d, seen[d])) for d in args.i)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        state.close()
+        if notifier is not None:
+            notifier.close()
+    for dirpath in args.i:
+        print(OKGREEN + " >>>> " + dirpath + ENDC)
+        print ("Unique bugs             :", len(bugs[dirpath]))
+        print ("Triaged testcases       :", len(seen[dirpath]))
+
+replayers = make_replayers(max(1, args.jobs))
+if profile.enabled:
+    replayers = [profile.timed_replayer(r) for r in replayers]
+
+cache = None
+if args.cache:
+    cache = ResultCache(args.cache, args.clear_cache)
+
+symbolizer = None
+if args.defer_symbolize:
+    symbolizer = Symbolizer()
+
+if args.watch:
+    watch()
+    sys.exit(0)
+
+def load_journal(path):
+    # rebuilds the buckets of an interrupted run without replaying anything
+    done = dict((d, set()) for d in args.i)
+    if not os.path.exists(path):
+        return done
+    with open(path) as f:
+        for l in f:
+            try:
+                e = json.loads(l)
+            except ValueError:
+                # the last line of a killed run may be truncated
+                continue
+            if e["dir"] not in done:
+                continue
+            asan_type, memaccess, stacktrace, ubsan, hang = e["result"]
+            result = (asan_type, memaccess, [tuple(a) for a in stacktrace], [tuple(u) for u in ubsan], hang, None)
+            account(e["dir"], e["path"], classify(result, e["path"], e["size"], e["time"]))
+            done[e["dir"]].add(e["path"])
+    return done
+
+def account(dirpath, path, classified):
+    ubsan_bugs, asan_bugs, hangs = journal_bugs[dirpath]
+    errs, asan, hang = classified
+    if hang:
+        hangs.append(path)
+    if asan is not None:
+        key, crash = asan
+        add_crash(asan_bugs, key, crash)
+    for c in errs:
+        add_crash(ubsan_bugs, c.loc, c)
+
 total_ubsan_bugs = {}
 total_asan_bugs = {}
+total_hangs = {}
 
 bugs_summary = {}
 
-for dirpath in args.i:
-    ubsan_bugs = {}
-    asan_bugs = {}
+journal_bugs = dict((d, ({}, {}, [])) for d in args.i)
+journal = None
+already_done = dict((d, set()) for d in args.i)
+if args.jsonl is not None:
+    if args.resume:
+        already_done = load_journal(args.jsonl)
+    journal = open(args.jsonl, "a" if args.resume else "w")
+    if journal.tell() > 0:
+        with open(args.jsonl, "rb") as f:
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) != b"\n":
+                journal.write("\n")
+
+for dir_index, dirpath in enumerate(args.i):
+    ubsan_bugs, asan_bugs, hangs = journal_bugs[dirpath]
     print (OKGREEN + " >>>> " + dirpath + ENDC)
-    for fname in log_progress(os.listdir(dirpath)):
-        path = os.path.join(dirpath, fname)
-        size = os.path.getsize(path)
-        argv = args.target[:]
-        stdin_file = path
-        for i in range(len(argv)):
-            if argv[i] == "@@":
-                argv[i] = path
-                if args.f:
-                    shutil.copy(argv[i], args.f)
-                    argv[i] = args.f
-                stdin_file = None
-        errs = set()
-        one_found = False
-        start_asan = False
-        in_trace = True
-        stacktrace = []
-        memaccess = ''
-        first_st = None
-        asan_type = ""
-        for l in run(argv, stdin_file):
-            if l.startswith(b"================================================================="):
-                start_asan = True
-            elif start_asan and b"ERROR: AddressSanitizer:" in l:
-                l = l[l.find(b"ERROR: AddressSanitizer: ") + len(b"ERROR: AddressSanitizer: "):]
-                asan_type = l.decode("utf-8")
-            elif start_asan and b"ERROR: QEMU-AddressSanitizer:" in l:
-                l = l[l.find(b"ERROR: QEMU-AddressSanitizer: ") + len(b"ERROR: QEMU-AddressSanitizer: "):]
-                asan_type = l.decode("utf-8")
-            elif start_asan and l.startswith(b'READ'):
-                memaccess = 'read'
-            elif start_asan and l.startswith(b'WRITE'):
-                memaccess = 'write'
-            elif (start_asan or in_trace) and l.startswith(b"    #"):
-                in_trace = True
-                start_asan = False
-                ls = l.split()
-                if first_st is None and b'libstdc++' not in l and b'/libc.' not in l and b'glibc' not in l:
-                    first_st = (int(ls[1], 0), (b" ".join(ls[1:])).decode("utf-8"))
-                if b'libstdc++' not in l and b'/libc.' not in l and b'glibc' not in l:
-                    stacktrace.append((int(ls[1], 0), (b" ".join(ls[1:])).decode("utf-8")))
-            elif in_trace:
-                in_trace = False
-            elif b": runtime error: " in l:
-                l = l.split(b": runtime error: ")
-                type_ = l[1].decode("utf-8")
-                loc = l[0].decode("utf-8")
-                errs.add(UbsanCrash(type_, loc, path, size))
-                one_found = True
-        #if not one_found and len(stacktrace) == 0:
-            #warn(path + " does not trigger any violation!")
-        if len(stacktrace) > 0:
-            st = first_st
-            etype = asan_type.split()[0]
-            if not args.c and etype != 'ILL':
-                st = callstack_hash(stacktrace)
-            asan_bugs[(st, etype, memaccess)] = asan_bugs.get(st, []) + [AsanCrash(asan_type, stacktrace, first_st[1], path, size)]
-        for c in errs:
-            ubsan_bugs[c.loc] = ubsan_bugs.get(c.loc, []) + [c]
+    with profile.phase("ingest"):
+        paths = list_testcases(dirpath)
+        paths = [path for path in paths if path not in already_done[dirpath]]
+    profile.count("testcases", len(paths))
+    for path, result in zip(paths, log_progress(profile.iterate("replay", triage_all(paths)))):
+        with profile.phase("bucketing"):
+            size = testcase_size(path)
+            time_ = get_testcase_time(path)
+            classified = classify(result, path, size, time_)
+            if classified[2]:
+                warn(path + " hangs (timeout or output limit reached)")
+            account(dirpath, path, classified)
+            if journal is not None:
+                journal.write(json.dumps({"dir": dirpath, "path": path, "size": size, "time": time_, "result": result[:5]}) + "\n")
+                journal.flush()
+        profile.count("testcase bytes", size)
 
     total_ubsan_bugs[dirpath] = set()
     total_asan_bugs[dirpath] = set()
+    total_hangs[dirpath] = hangs
 
     term_w = 0
     for s in ubsan_bugs:
         total_ubsan_bugs[dirpath].add(s)
-        if args.t:
-            ubsan_bugs[s] = sorted(ubsan_bugs[s], key=lambda x: x.time)
-        else:
-            ubsan_bugs[s] = sorted(ubsan_bugs[s], key=lambda x: x.size)
+        best = ubsan_bugs[s].best
         if args.j is not None:
             b = {}
             b["loc"] = s
-            b["time"] = ubsan_bugs[s][0].time
+            b["time"] = best.time
+            b["count"] = ubsan_bugs[s].count
             bugs_summary[dirpath] = bugs_summary.get(dirpath, [])
             bugs_summary[dirpath].append(b)
         if term_w == 0:
-            term_w, _ = shutil.get_terminal_size((19 + max(len(ubsan_bugs[s][0].path), len(s)), 20))
+            term_w, _ = shutil.get_terminal_size((19 + max(len(best.path), len(s)), 20))
         if args.r or args.R:
             print(HEADER + "=" * term_w + ENDC)
-            print(BOLD + " Error type     : " + ubsan_bugs[s][0].type + ENDC)
-            print(BOLD + " Error location : " + ubsan_bugs[s][0].loc + ENDC)
-            print(BOLD + " Testcase path  : " + ubsan_bugs[s][0].path + ENDC)
-            print(BOLD + " Testcase size  : " + str(ubsan_bugs[s][0].size) + ENDC)
+            print(BOLD + " Error type     : " + best.type + ENDC)
+            print(BOLD + " Error location : " + best.loc + ENDC)
+            print(BOLD + " Testcase path  : " + best.path + ENDC)
+            print(BOLD + " Testcase size  : " + str(best.size) + ENDC)
+            print(BOLD + " Testcases      : " + str(ubsan_bugs[s].count) + ENDC)
             print(HEADER + "=" * term_w + ENDC)
-        argv = args.target[:]
-        stdin_file = ubsan_bugs[s][0].path
-        for i in range(len(argv)):
-            if argv[i] == "@@":
-                argv[i] = ubsan_bugs[s][0].path
-                if args.f:
-                    shutil.copy(argv[i], args.f)
-                    argv[i] = args.f
-                stdin_file = None
-        run(argv, stdin_file, args.s)
+        if args.s:
+            show_output(best.output)
+
+    if symbolizer is not None:
+        with profile.phase("symbolize"):
+            symbolizer.symbolize([asan_bugs[s].best for s in asan_bugs])
 
     for s in asan_bugs:
         total_asan_bugs[dirpath].add(s)
-        if args.t:
-            asan_bugs[s] = sorted(asan_bugs[s], key=lambda x: x.time)
-        else:
-            asan_bugs[s] = sorted(asan_bugs[s], key=lambda x: x.size)
+        best = asan_bugs[s].best
         if args.j is not None:
             b = {}
-            b["loc"] = s[0][0]
-            b["time"] = asan_bugs[s][0].time
+            b["loc"] = s[0]
+            b["time"] = best.time
+            b["count"] = asan_bugs[s].count
             bugs_summary[dirpath] = bugs_summary.get(dirpath, [])
             bugs_summary[dirpath].append(b)
         if term_w == 0:
-            term_w, _ = shutil.get_terminal_size((19 + max(len(asan_bugs[s][0].path), len(asan_bugs[s][0].loc), len(asan_bugs[s][0].type)), 20))
+            term_w, _ = shutil.get_terminal_size((19 + max(len(best.path), len(best.loc), len(best.type)), 20))
         if args.r or args.R:
             print(HEADER + "=" * term_w + ENDC)
-            print(BOLD + " Error type     : " + asan_bugs[s][0].type + ENDC)
-            print(BOLD + " Error location : " + asan_bugs[s][0].loc + ENDC)
-            print(BOLD + " Testcase path  : " + asan_bugs[s][0].path + ENDC)
-            print(BOLD + " Testcase size  : " + str(asan_bugs[s][0].size) + ENDC)
+            print(BOLD + " Error type     : " + best.type + ENDC)
+            print(BOLD + " Error location : " + best.loc + ENDC)
+            print(BOLD + " Testcase path  : " + best.path + ENDC)
+            print(BOLD + " Testcase size  : " + str(best.size) + ENDC)
+            print(BOLD + " Testcases      : " + str(asan_bugs[s].count) + ENDC)
             if args.R:
                 print(BOLD + " Stacktrace     : " + ENDC)
                 i = 0
-                for addr, rep in asan_bugs[s][0].trace:
+                for addr, rep in best.trace:
                     print('\t' + ('#'+str(i)).ljust(3, ' ') + ' ' + str(rep))
                     i += 1
             print(HEADER + "=" * term_w + ENDC)
-        argv = args.target[:]
-        stdin_file = asan_bugs[s][0].path
-        for i in range(len(argv)):
-            if argv[i] == "@@":
-                argv[i] = asan_bugs[s][0].path
-                if args.f:
-                    shutil.copy(argv[i], args.f)
-                    argv[i] = args.f
-                stdin_file = None
-        run(argv, stdin_file, args.s)
+        if args.s:
+            show_output(best.output)
+
+    if args.minimize is not None:
+        with profile.phase("minimize"):
+            minimize_bugs(dir_index, ubsan_bugs, asan_bugs)
 
     print ("Unique UBSan violations :", len(ubsan_bugs))
     print ("Unique ASan violations  :", len(asan_bugs))
+    print ("Hangs                   :", len(hangs))
     print ()
 
+if symbolizer is not None:
+    symbolizer.close()
+if journal is not None:
+    journal.close()
+
+def intersect(total):
+    # inverted index bug -> bitset of the directories that found it
+    dirs = list(total.keys())
+    index = {}
+    for i, d in enumerate(dirs):
+        for key in total[d]:
+            index[key] = index.get(key, 0) | (1 << i)
+    common = [[0] * len(dirs) for _ in dirs]
+    unique = dict((d, []) for d in dirs)
+    everywhere = []
+    full = (1 << len(dirs)) - 1
+    for key, mask in index.items():
+        members = []
+        m = mask
+        while m:
+            low = m & -m
+            members.append(low.bit_length() - 1)
+            m ^= low
+        for a in members:
+            for b in members:
+                common[a][b] += 1
+        if len(members) == 1:
+            unique[dirs[members[0]]].append(key)
+        if mask == full:
+            everywhere.append(key)
+    jaccard = [[0.0] * len(dirs) for _ in dirs]
+    for a in range(len(dirs)):
+        for b in range(len(dirs)):
+            union = common[a][a] + common[b][b] - common[a][b]
+            if union > 0:
+                jaccard[a][b] = common[a][b] / union
+    return {"dirs": dirs, "common": common, "jaccard": jaccard, "unique": unique, "found_by_all": everywhere}
+
+def save_intersections(path, inters):
+    if path.endswith(".json"):
+        with open(path, "w") as f:
+            json.dump(inters, f)
+        return
+    with open(path, "w", newline="") as f:
+        w = csv.writer(f)
+        w.writerow(["sanitizer", "dir_a", "dir_b", "bugs_a", "bugs_b", "common", "jaccard"])
+        for san in ("ubsan", "asan"):
+            dirs, common, jaccard = inters[san]["dirs"], inters[san]["common"], inters[san]["jaccard"]
+            for a in range(len(dirs)):
+                for b in range(a + 1, len(dirs)):
+                    w.writerow([san, dirs[a], dirs[b], common[a][a], common[b][b], common[a][b], "%.4f" % jaccard[a][b]])
+
 print(OKBLUE + " >>>> Intersections" + ENDC)
-already_intersected = []
-for dirpath1 in total_ubsan_bugs.keys():
-    for dirpath2 in total_ubsan_bugs.keys():
-        if dirpath1 == dirpath2: continue
-        if sorted((dirpath1, dirpath2)) in already_intersected: continue
-        already_intersected.append(sorted((dirpath1, dirpath2)))
-        print ("Intersection of UBSan violations for", dirpath1, "and", dirpath2, ":", len(total_ubsan_bugs[dirpath1].intersection(total_ubsan_bugs[dirpath2])))
-        print ("Intersection of ASan violations for", dirpath1, "and", dirpath2, " :", len(total_asan_bugs[dirpath1].intersection(total_asan_bugs[dirpath2])))
+with profile.phase("intersections"):
+    inters = {"ubsan": intersect(total_ubsan_bugs), "asan": intersect(total_asan_bugs)}
+dirs = inters["ubsan"]["dirs"]
+if len(dirs) <= 10:
+    for a in range(len(dirs)):
+        for b in range(a + 1, len(dirs)):
+            print ("Intersection of UBSan violations for", dirs[a], "and", dirs[b], ":", inters["ubsan"]["common"][a][b])
+            print ("Intersection of ASan violations for", dirs[a], "and", dirs[b], " :", inters["asan"]["common"][a][b])
+else:
+    print ("Pairwise intersections of", len(dirs), "directories omitted, use --intersections")
+if len(dirs) > 1:
+    for dirpath in dirs:
+        print ("Bugs found only by", dirpath, ":", len(inters["ubsan"]["unique"][dirpath]), "UBSan,", len(inters["asan"]["unique"][dirpath]), "ASan")
+    print ("Bugs found by all directories :", len(inters["ubsan"]["found_by_all"]), "UBSan,", len(inters["asan"]["found_by_all"]), "ASan")
+if args.intersections is not None:
+    save_intersections(args.intersections, inters)
 print()
 
 from functools import reduce